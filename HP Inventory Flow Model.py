@@ -17,41 +17,299 @@ stockoutProb = 0.02
 duration = 52
 numTrials = 10**2
 
-def replenishSimulation(meanWeeklyDemand, stdDevWeeklyDemand, leadTime, stockoutProb, durInWeeks, numTrials):
-    #Results storage
-    detailedPipelineResults = np.zeros((numTrials, durInWeeks))
-    detailedSafteyStockResults = np.zeros((numTrials, durInWeeks))
-    simAvgPipelineVolume = 0.0
-    
-    #Initialize pipeline and safety stock
-    pipeline = [ meanWeeklyDemand for i in range(leadTime) ]
+def simulateTrials(meanWeeklyDemand, stdDevWeeklyDemand, leadTime, safetyStock, durInWeeks, numTrials, randomState=np.random):
+    '''
+    Simulates numTrials independent trials at once. Every trial starts with
+    the pipeline full of mean weekly demand and the given safety stock.
+
+    Each week's order arrives leadTime weeks later, so the pipeline always
+    holds the last leadTime weeks of demand and the safety stock moves by the
+    opposite amount. The pipeline volume is therefore a rolling window sum
+    of the (numTrials, durInWeeks) demand matrix.
+
+    OUTPUT
+    tuple of (numTrials, durInWeeks) arrays (pipelineVolume, safetyStock)
+    '''
+    demand = randomState.normal(meanWeeklyDemand, stdDevWeeklyDemand, (numTrials, durInWeeks))
+
+    #Rolling window sum over the demand, padded with the initial pipeline
+    padded = np.empty((numTrials, leadTime + durInWeeks + 1))
+    padded[:,0] = 0.0
+    padded[:,1:leadTime+1] = meanWeeklyDemand
+    padded[:,leadTime+1:] = demand
+    cumulative = np.cumsum(padded, axis=1)
+    pipelineVolume = cumulative[:,leadTime+1:] - cumulative[:,1:durInWeeks+1]
+
+    safetyStockLevel = safetyStock + leadTime*meanWeeklyDemand - pipelineVolume
+
+    return pipelineVolume, safetyStockLevel
+
+def replenishSimulationBatch(meanWeeklyDemand, stdDevWeeklyDemand, leadTime, stockoutProb, durInWeeks, numTrials, chunkSize=10**5, randomState=np.random):
+    '''
+    Runs the replenishment simulation for numTrials trials in blocks of
+    chunkSize trials, without plotting
+
+    OUTPUT
+    tuple (average pipeline volume, stockout probability)
+    '''
     safetyStock = st.norm.ppf(1.0 - stockoutProb)*np.sqrt(leadTime)*stdDevWeeklyDemand
-    
+
+    totalPipelineVolume = 0.0
     stockouts = 0
-    
+    for start in range(0, numTrials, chunkSize):
+        trials = min(chunkSize, numTrials - start)
+        pipelineVolume, safetyStockLevel = simulateTrials(meanWeeklyDemand, stdDevWeeklyDemand, leadTime, \
+                                                          safetyStock, durInWeeks, trials, randomState)
+        totalPipelineVolume += pipelineVolume.sum()
+        stockouts += np.count_nonzero(safetyStockLevel <= 0)
+
+    return totalPipelineVolume/(numTrials*durInWeeks), float(stockouts)/(numTrials*durInWeeks)
+
+class StreamingStats(object):
+    def __init__(self, low=None, high=None, numBins=4000):
+        '''
+        Running mean and variance of a stream of values fed in blocks. When
+        low and high are given, a fixed histogram over that range is also kept
+        so quantiles can be estimated; values outside the range are counted
+        in the end bins.
+        '''
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.edges = None if low is None else np.linspace(low, high, numBins + 1)
+        self.counts = None if low is None else np.zeros(numBins, dtype=np.int64)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        if values.size == 0:
+            return
+
+        #Merge the block's moments with the running ones
+        n = values.size
+        blockMean = values.mean()
+        delta = blockMean - self.mean
+        total = self.count + n
+        self.m2 += ((values - blockMean)**2).sum() + delta*delta*self.count*n/total
+        self.mean += delta*n/total
+        self.count = total
+
+        if self.edges is not None:
+            width = self.edges[1] - self.edges[0]
+            bins = np.clip(np.floor((values - self.edges[0])/width), 0, len(self.counts) - 1).astype(np.int64)
+            self.counts += np.bincount(bins, minlength=len(self.counts))
+
+    def variance(self):
+        return self.m2/(self.count - 1) if self.count > 1 else 0.0
+
+    def std(self):
+        return np.sqrt(self.variance())
+
+    def quantile(self, q):
+        #Interpolates within the histogram bin holding the q-th value
+        cumulative = np.concatenate(([0], np.cumsum(self.counts)))/float(self.count)
+        return np.interp(q, cumulative, self.edges)
+
+def replenishSimulationStreaming(meanWeeklyDemand, stdDevWeeklyDemand, leadTime, stockoutProb, durInWeeks, numTrials, \
+                                 chunkSize=10**5, quantiles=(0.05, 0.5, 0.95), confidence=0.95, numSamples=0, \
+                                 randomState=np.random):
+    '''
+    Runs the replenishment simulation keeping only running statistics, so
+    memory does not grow with the number of trials
+
+    INPUT
+    quantiles: quantiles of pipeline volume and safety stock to estimate
+    confidence: level of the confidence interval on the stockout probability
+    numSamples: number of trial trajectories to keep for plotting, drawn by
+                reservoir sampling
+
+    OUTPUT
+    dictionary of results
+    '''
+    safetyStock = st.norm.ppf(1.0 - stockoutProb)*np.sqrt(leadTime)*stdDevWeeklyDemand
+    spread = 10*np.sqrt(leadTime)*stdDevWeeklyDemand
+    pipelineStats = StreamingStats(leadTime*meanWeeklyDemand - spread, leadTime*meanWeeklyDemand + spread)
+    safetyStockStats = StreamingStats(safetyStock - spread, safetyStock + spread)
+    #Weeks within a trial are correlated, so the interval uses the spread of
+    #the per-trial stockout rates
+    stockoutStats = StreamingStats()
+
+    samplePipeline = np.empty((numSamples, durInWeeks))
+    sampleSafetyStock = np.empty((numSamples, durInWeeks))
+
+    for start in range(0, numTrials, chunkSize):
+        trials = min(chunkSize, numTrials - start)
+        pipelineVolume, safetyStockLevel = simulateTrials(meanWeeklyDemand, stdDevWeeklyDemand, leadTime, \
+                                                          safetyStock, durInWeeks, trials, randomState)
+        pipelineStats.update(pipelineVolume)
+        safetyStockStats.update(safetyStockLevel)
+        stockoutStats.update(np.mean(safetyStockLevel <= 0, axis=1))
+
+        #Reservoir sampling of whole trajectories, trial k replaces a random
+        #sample with probability numSamples/(k+1)
+        if numSamples > 0:
+            trial = np.arange(start, start + trials)
+            slots = np.where(trial < numSamples, trial, np.floor(randomState.rand(trials)*(trial + 1)).astype(np.int64))
+            for i in np.nonzero(slots < numSamples)[0]:
+                samplePipeline[slots[i]] = pipelineVolume[i]
+                sampleSafetyStock[slots[i]] = safetyStockLevel[i]
+
+    halfWidth = st.norm.ppf(0.5 + confidence/2.0)*stockoutStats.std()/np.sqrt(numTrials)
+
+    return {'pipelineMean': pipelineStats.mean,
+            'pipelineStd': pipelineStats.std(),
+            'pipelineQuantiles': pipelineStats.quantile(quantiles),
+            'safetyStockMean': safetyStockStats.mean,
+            'safetyStockStd': safetyStockStats.std(),
+            'safetyStockQuantiles': safetyStockStats.quantile(quantiles),
+            'stockoutProb': stockoutStats.mean,
+            'stockoutProbCI': (stockoutStats.mean - halfWidth, stockoutStats.mean + halfWidth),
+            'samplePipeline': samplePipeline[:min(numSamples, numTrials)],
+            'sampleSafetyStock': sampleSafetyStock[:min(numSamples, numTrials)]}
+
+def commonRandomDemand(meanWeeklyDemand, stdDevWeeklyDemand, maxLeadTime, durInWeeks, numTrials, randomState=np.random):
+    '''
+    Draws one set of demand paths to be shared by every safety stock and lead
+    time candidate up to maxLeadTime weeks. The paths are returned as
+    cumulative sums, padded in front with maxLeadTime weeks of mean demand
+    for the initial pipeline.
+    '''
+    padded = np.empty((numTrials, maxLeadTime + durInWeeks + 1))
+    padded[:,0] = 0.0
+    padded[:,1:maxLeadTime+1] = meanWeeklyDemand
+    padded[:,maxLeadTime+1:] = randomState.normal(meanWeeklyDemand, stdDevWeeklyDemand, (numTrials, durInWeeks))
+
+    return np.cumsum(padded, axis=1)
+
+def leadTimeExcess(cumulativeDemand, meanWeeklyDemand, leadTime, durInWeeks):
+    '''
+    Pipeline volume minus its mean for every trial and week. Since the safety
+    stock falls by exactly this amount, a week stocks out when the excess
+    reaches the initial safety stock.
+    '''
+    start = cumulativeDemand.shape[1] - durInWeeks
+    if start - 1 < leadTime:
+        raise ValueError("Lead time %s exceeds the %i weeks of pipeline the demand paths were drawn for" % (leadTime, start - 1))
+    pipelineVolume = cumulativeDemand[:,start:] - cumulativeDemand[:,start-leadTime:cumulativeDemand.shape[1]-leadTime]
+    return pipelineVolume - leadTime*meanWeeklyDemand
+
+def findMinSafetyStock(cumulativeDemand, meanWeeklyDemand, leadTimes, durInWeeks, targetStockoutProb):
+    '''
+    Finds, for each lead time, the smallest safety stock whose stockout rate
+    over the shared demand paths does not exceed targetStockoutProb. The
+    stockout rate only falls as safety stock grows, so rather than bisecting
+    on it the answer is read off the sorted excess demand directly.
+
+    OUTPUT
+    array of minimum safety stocks, one per lead time
+    '''
+    safetyStocks = np.empty(len(leadTimes))
+    for i, leadTime in enumerate(leadTimes):
+        excess = leadTimeExcess(cumulativeDemand, meanWeeklyDemand, leadTime, durInWeeks).ravel()
+        allowed = int(np.floor(targetStockoutProb*excess.size))
+        if allowed >= excess.size:
+            safetyStocks[i] = -np.inf
+        else:
+            #Just above the largest excess that must not stock out
+            k = excess.size - allowed - 1
+            safetyStocks[i] = np.nextafter(np.partition(excess, k)[k], np.inf)
+
+    return safetyStocks
+
+def evaluateConfigurations(cumulativeDemand, meanWeeklyDemand, leadTimes, safetyStocks, durInWeeks):
+    '''
+    Evaluates every lead time and safety stock combination on the shared
+    demand paths in one pass per lead time
+
+    OUTPUT
+    tuple (stockout probabilities of shape (len(leadTimes), len(safetyStocks)),
+           average pipeline volume per lead time)
+    '''
+    stockoutProbs = np.empty((len(leadTimes), len(safetyStocks)))
+    avgPipelineVolume = np.empty(len(leadTimes))
+    for i, leadTime in enumerate(leadTimes):
+        excess = np.sort(leadTimeExcess(cumulativeDemand, meanWeeklyDemand, leadTime, durInWeeks).ravel())
+        stockouts = excess.size - np.searchsorted(excess, safetyStocks, side='left')
+        stockoutProbs[i] = stockouts/float(excess.size)
+        avgPipelineVolume[i] = excess.mean() + leadTime*meanWeeklyDemand
+
+    return stockoutProbs, avgPipelineVolume
+
+def simulateNetwork(network, durInWeeks, numTrials, chunkSize=20, randomState=np.random):
+    '''
+    Simulates the replenishment model of every SKU at every location together
+    as stacked arrays, chunkSize trials at a time
+
+    INPUT
+    network: DataFrame with one row per SKU and location and the columns
+             'SKU', 'Location', 'Weekly Demand', 'Weekly Std Dev',
+             'Lead Time' (weeks), 'Stockout Prob' and 'Unit Cost'
+    durInWeeks: number of weeks per trial
+    numTrials: number of trials
+
+    OUTPUT
+    tuple (rows, bySKU, totals), rows is network with the simulated
+    'Safety Stock', 'Avg Pipeline Volume', 'Avg Safety Stock',
+    'Pipeline Investment', 'Safety Stock Investment' and 'Stockout Rate',
+    bySKU sums the volumes and investments over locations and averages the
+    stockout rate, and totals is the same over the whole network
+    '''
+    mean = network['Weekly Demand'].values.astype(float)
+    stdDev = network['Weekly Std Dev'].values.astype(float)
+    leadTime = network['Lead Time'].values.astype(np.int64)
+    safetyStock = st.norm.ppf(1.0 - network['Stockout Prob'].values)*np.sqrt(leadTime)*stdDev
+    numRows = len(network)
+    maxLeadTime = leadTime.max()
+
+    #Column of the cumulative demand at the start of each row's window
+    weeks = np.arange(durInWeeks)
+    windowEnd = maxLeadTime + 1 + weeks[None,:]
+    windowStart = (windowEnd - leadTime[:,None])[None,:,:]
+
+    pipelineTotal = np.zeros(numRows)
+    safetyStockTotal = np.zeros(numRows)
+    stockouts = np.zeros(numRows, dtype=np.int64)
+
+    for start in range(0, numTrials, chunkSize):
+        trials = min(chunkSize, numTrials - start)
+        padded = np.empty((trials, numRows, maxLeadTime + durInWeeks + 1))
+        padded[:,:,0] = 0.0
+        padded[:,:,1:maxLeadTime+1] = mean[None,:,None]
+        padded[:,:,maxLeadTime+1:] = randomState.normal(mean[None,:,None], stdDev[None,:,None], (trials, numRows, durInWeeks))
+        cumulative = np.cumsum(padded, axis=2)
+
+        pipelineVolume = cumulative[:,:,maxLeadTime+1:] - \
+                         np.take_along_axis(cumulative, np.broadcast_to(windowStart, (trials, numRows, durInWeeks)), axis=2)
+        safetyStockLevel = (safetyStock + leadTime*mean)[None,:,None] - pipelineVolume
+
+        pipelineTotal += pipelineVolume.sum(axis=(0, 2))
+        safetyStockTotal += safetyStockLevel.sum(axis=(0, 2))
+        stockouts += np.count_nonzero(safetyStockLevel <= 0, axis=(0, 2))
+
+    numObservations = float(numTrials*durInWeeks)
+    rows = network.copy()
+    rows['Safety Stock'] = safetyStock
+    rows['Avg Pipeline Volume'] = pipelineTotal/numObservations
+    rows['Avg Safety Stock'] = safetyStockTotal/numObservations
+    rows['Pipeline Investment'] = rows['Avg Pipeline Volume']*rows['Unit Cost']
+    rows['Safety Stock Investment'] = rows['Avg Safety Stock']*rows['Unit Cost']
+    rows['Stockout Rate'] = stockouts/numObservations
+
+    summed = ['Avg Pipeline Volume', 'Avg Safety Stock', 'Pipeline Investment', 'Safety Stock Investment']
+    bySKU = rows.groupby('SKU')[summed].sum()
+    bySKU['Stockout Rate'] = rows.groupby('SKU')['Stockout Rate'].mean()
+    totals = rows[summed].sum()
+    totals['Stockout Rate'] = rows['Stockout Rate'].mean()
+
+    return rows, bySKU, totals
+
+def replenishSimulation(meanWeeklyDemand, stdDevWeeklyDemand, leadTime, stockoutProb, durInWeeks, numTrials):
     #Run trials
-    for trial in range(numTrials):
-        trialAvgPipelineVol = 0.0
-        for week in range(durInWeeks):
-            currentDemand = np.random.normal(meanWeeklyDemand, stdDevWeeklyDemand)
-            safetyStock -= currentDemand
-            safetyStock += pipeline.pop()
-            
-            if safetyStock <= 0:
-                stockouts += 1
-            
-            detailedSafteyStockResults[trial, week] = safetyStock
-            pipeline.insert(0, currentDemand)
-            
-            pipelineVolume = np.sum(pipeline)
-            detailedPipelineResults[trial, week] = pipelineVolume
-            trialAvgPipelineVol += pipelineVolume
-        
-        trialAvgPipelineVol /= durInWeeks
-        simAvgPipelineVolume += trialAvgPipelineVol
-        
-    simAvgPipelineVolume /= numTrials
-    stockoutProbResult = float(stockouts)/(numTrials*durInWeeks)
+    safetyStock = st.norm.ppf(1.0 - stockoutProb)*np.sqrt(leadTime)*stdDevWeeklyDemand
+    detailedPipelineResults, detailedSafteyStockResults = simulateTrials(meanWeeklyDemand, stdDevWeeklyDemand, \
+                                                                         leadTime, safetyStock, durInWeeks, numTrials)
+    
+    simAvgPipelineVolume = detailedPipelineResults.mean()
+    stockoutProbResult = float(np.count_nonzero(detailedSafteyStockResults <= 0))/(numTrials*durInWeeks)
     
     print "Average pipeline volume is %f units" % simAvgPipelineVolume
     print "Stockout probability is %f" % stockoutProbResult
@@ -1,59 +1,122 @@
+import inspect
+import itertools
 import numpy as np
 import pandas as pd
 import scipy.special as sp
 from inventoryManagement import *
 import matplotlib.pyplot as plt
 
+def parameterizedReorderPolicy(inputs, factor=1.4, offset=10):
+    #Proposed reorder rule with its parameters exposed for sweeps
+    mu = np.asarray(inputs[0], dtype=float)
+    leadTime = np.asarray(inputs[1], dtype=float)
+    return np.where(mu <= 0, -1, np.floor( factor*mu*(leadTime+offset)/365.0 ))
+
+def parameterizedMILPolicy(mu, lowUsage=5, highUsage=50, lowFactor=1.0, midFactor=2.0/3, highFactor=0.5):
+    #MIL rule with its usage thresholds and multipliers exposed for sweeps
+    mu = np.asarray(mu, dtype=float)
+    return np.select([mu <= 0, mu <= lowUsage, mu < highUsage], \
+                     [0, np.ceil(lowFactor*mu), np.ceil(midFactor*mu)], np.ceil(highFactor*mu))
+
 def existingATReorderPolicy(mu):
-    if mu <= 0:
-        return -1
-    elif mu > 0 and mu <= 5:
-        return np.floor(5.0/12*mu)
-    elif mu > 5 and mu < 50:
-        return np.floor(5.0/12*mu)
-    else:
-        return np.floor(mu/3.0)
+    mu = np.asarray(mu, dtype=float)
+    return np.select([mu <= 0, mu < 50], [-1, np.floor(5.0/12*mu)], np.floor(mu/3.0))
         
 def existingATMILPolicy(mu):
-    if mu <= 0:
-        return 0
-    elif mu > 0 and mu <= 5:
-        return np.ceil(mu)
-    elif mu > 5 and mu < 50:
-        return np.ceil(2.0/3*mu)
-    else:
-        return np.ceil(mu/2.0)
+    return parameterizedMILPolicy(mu)
         
 def proposedATReorderPolicy(inputs):
-    if inputs[0] <= 0:
-        return -1
-    else:
-        return np.floor( 1.4*inputs[0]*(inputs[1]+10)/365.0 )
+    return parameterizedReorderPolicy(inputs)
         
 def proposedATMILPolicy(mu):
-    if mu <= 0:
-        return 0
-    elif mu > 0 and mu <= 5:
-        return np.ceil(mu)
-    elif mu > 5 and mu < 50:
-        return np.ceil(2.0/3*mu)
+    return parameterizedMILPolicy(mu)
+
+def policyInputs(atData, variable):
+    #A single column is passed to a policy as an array, a list of columns as a
+    #tuple of arrays
+    if isinstance(variable, str):
+        return atData[variable].values
     else:
-        return np.ceil(mu/2.0)
+        return tuple( atData[v].values for v in variable )
     
 def calculatePerformance(atData, reorderPolicy, reorderVariable, milPolicy, milVariable):
     atData['Daily Demand'] = atData['Total Usage']/365.0
     atData['theta'] = atData['Daily Demand'] * atData['Lead Time (days)']
-    atData['r'] = [ reorderPolicy(mu) for mu in atData[reorderVariable] ]
-    atData['mil'] = [ milPolicy(mu) for mu in atData[milVariable] ]
+    atData['r'] = reorderPolicy(policyInputs(atData, reorderVariable))
+    atData['mil'] = milPolicy(policyInputs(atData, milVariable))
     atData['Q'] = atData['mil'] - atData['r']
     atData['Order Frequency'] = atData['Total Usage']/atData['Q']
     atData['Order Interval'] = 365.0/atData['Order Frequency']
-    atData['Service Level'] = [GPoisson(r, theta) for r, theta in zip(atData['r'], atData['theta'])]
-    atData['Fill Rate'] = [SPoisson(Q, r, theta) for Q, r, theta in zip(atData['Q'], atData['r'], atData['theta'])]
-    atData['Backorder Level'] = [ BPoisson(Q, r, theta) for Q, r, theta in zip(atData['Q'], atData['r'], atData['theta']) ]
-    atData['Inventory Level'] = [ IPoisson(Q, r, theta, b) for Q, r, theta, b in zip(atData['Q'], atData['r'], atData['theta'], atData['Backorder Level']) ]
+
+    Q = atData['Q'].values
+    r = atData['r'].values
+    theta = atData['theta'].values
+    atData['Service Level'] = GPoissonVec(r, theta)
+    atData['Fill Rate'] = SPoissonVec(Q, r, theta)
+    atData['Backorder Level'] = BPoissonVec(Q, r, theta)
+    atData['Inventory Level'] = IPoissonVec(Q, r, theta, atData['Backorder Level'].values)
     atData['Implied A'] = atData['Q']**2*atData['Unit Cost']/(2*atData['Total Usage'])
     
+def sweepPolicies(atData, paramGrid, reorderPolicy=parameterizedReorderPolicy, milPolicy=parameterizedMILPolicy):
+    '''
+    Evaluates every combination of policy parameters against the part data
+    in one batch. Demand and theta are computed once, and identical
+    (r, Q, theta) triples across parts and grid points are evaluated once.
+
+    INPUT
+    atData: part data with the columns of dcData.csv
+    paramGrid: dictionary of parameter name to list of values, each name must
+               be a keyword of reorderPolicy or milPolicy
+    reorderPolicy: function of (usage, lead time) and its keywords, any
+                   callable with a signature such as a functools.partial
+    milPolicy: function of usage and its keywords
+
+    OUTPUT
+    DataFrame with one row per grid point holding its parameters, the
+    inventory investment, the sales weighted fill rate and service level and
+    the sales weighted order frequency, and the number of parts left without
+    a valid order quantity
+    '''
+    usage = atData['Total Usage'].values.astype(float)
+    leadTime = atData['Lead Time (days)'].values.astype(float)
+    unitCost = atData['Unit Cost'].values.astype(float)
+    theta = usage/365.0*leadTime
+    salesWeight = usage*unitCost/np.sum(usage*unitCost)
+
+    #Grid keys the reorder policy accepts go to it, the rest to the MIL policy
+    reorderArgs = list(inspect.signature(reorderPolicy).parameters)[1:]
+    names = sorted(paramGrid)
+    grid = [ dict(zip(names, values)) for values in itertools.product(*[paramGrid[n] for n in names]) ]
+
+    r = np.empty((len(grid), len(atData)))
+    Q = np.empty((len(grid), len(atData)))
+    for g, params in enumerate(grid):
+        r[g] = reorderPolicy((usage, leadTime), **{ k: v for k, v in params.items() if k in reorderArgs })
+        mil = milPolicy(usage, **{ k: v for k, v in params.items() if k not in reorderArgs })
+        Q[g] = mil - r[g]
+
+    #Parts whose MIL does not exceed their reorder point have no valid order
+    #quantity, they are counted but left out of the totals
+    valid = Q > 0
+    Q = np.where(valid, Q, 1)
+
+    #Evaluate each distinct (r, Q, theta) once
+    triples = np.column_stack((r.ravel(), Q.ravel(), np.tile(theta, len(grid))))
+    unique, inverse = np.unique(triples, axis=0, return_inverse=True)
+    inverse = inverse.reshape(len(grid), len(atData))
+    sl = GPoissonVec(unique[:,0], unique[:,2])
+    fr = SPoissonVec(unique[:,1], unique[:,0], unique[:,2])
+    inventory = IPoissonVec(unique[:,1], unique[:,0], unique[:,2], BPoissonVec(unique[:,1], unique[:,0], unique[:,2]))
+
+    results = pd.DataFrame(grid, columns=names)
+    results['I Investment'] = np.dot(valid*inventory[inverse], unitCost)
+    results['Fill Rate'] = np.dot(valid*fr[inverse], salesWeight)
+    results['Service Level'] = np.dot(valid*sl[inverse], salesWeight)
+    results['Order Frequency'] = np.dot(valid*usage/Q, salesWeight)
+    results['Invalid Parts'] = np.sum(~valid, axis=1)
+
+    return results
+
 #Load A&T data
 atRawData = pd.read_csv('dcData.csv', ',')
 
@@ -0,0 +1,346 @@
+################################################################################
+
+#Benchmarks and accuracy checks for the inventory theory kernels and the
+#Monte-Carlo pipeline. Run from this directory with
+#
+#   python benchmarkInventory.py [--trials N] [--evaluations N]
+#
+#Every kernel is timed in the small, medium and large theta regimes for both
+#the r < 0 and r >= 0 branches and compared against a direct summation of the
+#Poisson distribution. The script exits with status 1 when any kernel is off
+#by more than the tolerance, or when a check could not be run at all unless
+#--allow-skipped is given. Numba kernels that fail to compile are run as plain
+#Python so that their checks are still made.
+
+################################################################################
+
+import argparse
+import contextlib
+import math
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import scipy.special as sp
+import inventoryManagement
+import monteCarlo
+from inventoryManagement import *
+from monteCarlo import *
+
+regimes = {'small': (0.05, 2.0), 'medium': (5.0, 50.0), 'large': (200.0, 2000.0)}
+tolerance = 1E-8
+
+def loadBaseData(path='inputATDataForMC.csv'):
+    '''
+    Builds the baseData array of the A&T Monte-Carlo notebook from the
+    bundled part data
+    '''
+    parts = pd.read_csv(path)
+    parts = parts.loc[(parts['Unit Cost'] > 0.0001) & (parts['Total Usage'] > 0.6)]
+
+    numParts = len(parts)
+    baseData = np.empty((numParts, 8))
+    baseData[:,0] = range(numParts)
+    baseData[:,1] = parts['Unit Cost'].values
+    baseData[:,2] = parts['Total Usage'].values/365.0
+    baseData[:,3] = parts['Total Usage'].values/365.0*parts['Lead Time (days)'].values
+    baseData[:,4] = parts['Unit Cost'].values*parts['Total Usage'].values
+    baseData[:,4] /= baseData[:,4].sum()
+    baseData[:,5] = parts['Total Usage'].values/parts['Total Usage'].sum()
+    baseData[:,6] = 1.0/numParts
+    baseData[:,7] = np.sqrt(baseData[:,3])
+
+    return baseData
+
+def catalogueThetas(path='dcData.csv'):
+    #Lead time demand of every part with usage in the distribution center data
+    parts = pd.read_csv(path)
+    parts = parts.loc[parts['Total Usage'] > 0]
+    return (parts['Total Usage']/365.0*parts['Lead Time (days)']).values
+
+def kernelInputs(theta, negative, seed=0):
+    '''
+    Draws (Q, r) around the lead time demand theta, with r < 0 when negative
+    is True and r >= 0 otherwise
+    '''
+    randomState = np.random.RandomState(seed)
+    spread = np.ceil(3*np.sqrt(theta) + 3)
+    if negative:
+        r = -randomState.randint(1, 6, len(theta))
+    else:
+        r = np.maximum(0, np.floor(theta + (randomState.rand(len(theta))*2 - 1)*spread))
+    Q = randomState.randint(1, 4, len(theta))*spread
+
+    return Q.astype(float), r.astype(float)
+
+@contextlib.contextmanager
+def pythonKernels(modules=(inventoryManagement, monteCarlo)):
+    '''
+    Replaces every numba function in the modules by its Python function while
+    active, so a kernel that does not compile runs with its callees in Python
+    '''
+    patched = []
+    for module in modules:
+        for name, value in list(vars(module).items()):
+            if hasattr(value, 'py_func'):
+                patched.append((module, name, value))
+                setattr(module, name, value.py_func)
+    try:
+        yield
+    finally:
+        for module, name, value in patched:
+            setattr(module, name, value)
+
+def kernelMode(call):
+    '''
+    Returns ('jit', nullcontext) when call runs compiled and
+    ('python', pythonKernels) when numba fails to compile it
+    '''
+    try:
+        call()
+        return 'jit', contextlib.nullcontext
+    except Exception as e:
+        print("    numba failed (%s), running in Python" % str(e).splitlines()[0])
+        return 'python', pythonKernels
+
+################################################################################
+
+#Reference values by direct summation of the Poisson probabilities. gee1 is
+#taken as theta for r <= 0, as in inventoryManagement.
+
+################################################################################
+
+def poissonPMF(theta):
+    k = np.arange(0, int(theta + 40*np.sqrt(theta) + 60))
+    return k, np.exp(sp.xlogy(k, theta) - theta - sp.gammaln(k + 1))
+
+def referenceMetrics(Q, r, theta):
+    '''
+    Returns (service level, fill rate, backorders) for a single policy
+    '''
+    k, pmf = poissonPMF(theta)
+    Q = int(Q)
+    r = int(r)
+
+    #tail[j] = P(X > j) and excess[i] = E[(X - i)^+], summed from the far end
+    tail = np.cumsum(pmf[::-1])[::-1] - pmf
+    excess = np.cumsum(tail[::-1])[::-1]
+
+    def tailAt(j):
+        return 1.0 if j < 0 else tail[j]
+
+    def excessAt(i):
+        return excess[max(i, 0)]
+
+    serviceLevel = math.fsum(pmf[k <= r]) if r >= 0 else 0.0
+    fillRate = 1 - math.fsum(tailAt(j) for j in range(r, r + Q))/Q
+    backorders = math.fsum(excessAt(i) for i in range(r + 1, r + Q + 1))/Q
+
+    return serviceLevel, fillRate, backorders
+
+################################################################################
+
+#Benchmarks
+
+################################################################################
+
+def timeIt(func, numEvaluations, minTime=0.2):
+    '''
+    Returns evaluations per second of func, which evaluates numEvaluations
+    policies per call, or None when func fails
+    '''
+    try:
+        func()
+    except Exception as e:
+        print("    failed: %s" % str(e).splitlines()[0])
+        return None
+
+    calls = 0
+    start = time.time()
+    while (calls == 0) or (time.time() - start < minTime):
+        func()
+        calls += 1
+
+    return calls*numEvaluations/(time.time() - start)
+
+def kernelBenchmarks(numEvaluations, numScalar=200, numReference=100):
+    '''
+    Times the scalar, array and table versions of the kernels in every regime
+    and branch and checks each of them against the reference
+
+    OUTPUT
+    list of (regime, branch, kernel, evaluations per second, max error)
+    '''
+    rows = []
+    mode, kernels = kernelMode(lambda: (GPoisson(1.0, 1.0), SPoisson(2.0, 1.0, 1.0), BPoisson(2.0, 1.0, 1.0)))
+    scalarName = 'scalar' if mode == 'jit' else 'scalar-py'
+    for regime in sorted(regimes):
+        thetaLow, thetaHigh = regimes[regime]
+        for negative in (True, False):
+            branch = 'r < 0' if negative else 'r >= 0'
+            theta = np.random.RandomState(1).uniform(thetaLow, thetaHigh, numEvaluations)
+            if regime == 'medium':
+                #Mix in the lead time demands of the real catalogue
+                catalogue = catalogueThetas()[:numEvaluations]
+                theta[:len(catalogue)] = catalogue
+            Q, r = kernelInputs(theta, negative)
+
+            reference = np.array([ referenceMetrics(Q[i], r[i], theta[i]) for i in range(numReference) ])
+
+            sl, fr, bo = GPoissonVec(r, theta), SPoissonVec(Q, r, theta), BPoissonVec(Q, r, theta)
+            arrayError = np.abs(np.column_stack((sl, fr, bo))[:numReference] - reference).max()
+
+            im = inventoryManagement
+            with kernels():
+                scalarValues = np.array([ (im.GPoisson(r[i], theta[i]), im.SPoisson(Q[i], r[i], theta[i]), \
+                                           im.BPoisson(Q[i], r[i], theta[i])) for i in range(numReference) ])
+            scalarError = np.abs(scalarValues - reference).max()
+
+            tables = [ PoissonTable(theta[i], min(0, r[i]), r[i] + Q[i]) for i in range(numReference) ]
+            tableValues = np.array([ (t.GPoisson(r[i]), t.SPoisson(Q[i], r[i]), t.BPoisson(Q[i], r[i])) \
+                                     for i, t in enumerate(tables) ])
+            tableError = np.abs(tableValues - reference).max()
+
+            def scalarKernels():
+                with kernels():
+                    for i in range(numScalar):
+                        im.GPoisson(r[i], theta[i])
+                        im.SPoisson(Q[i], r[i], theta[i])
+                        im.BPoisson(Q[i], r[i], theta[i])
+
+            def arrayKernels():
+                GPoissonVec(r, theta)
+                SPoissonVec(Q, r, theta)
+                BPoissonVec(Q, r, theta)
+
+            #Table lookups for one part, as in the Monte-Carlo evaluator
+            table = PoissonTable(theta[0], min(0, r[0]) - 5, r[0] + 4*Q[0])
+            rTable = np.clip(r[0] + np.arange(numEvaluations) % 5 - 2, table.rMin, None)
+            QTable = Q[0] + np.arange(numEvaluations) % 3
+
+            def tableKernels():
+                table.GPoisson(rTable)
+                table.SPoisson(QTable, rTable)
+                table.BPoisson(QTable, rTable)
+
+            rows.append((regime, branch, scalarName, timeIt(scalarKernels, numScalar), scalarError))
+            rows.append((regime, branch, 'array', timeIt(arrayKernels, numEvaluations), arrayError))
+            rows.append((regime, branch, 'table', timeIt(tableKernels, numEvaluations), tableError))
+
+    return rows
+
+def inversionBenchmark(numEvaluations):
+    theta = np.random.RandomState(2).uniform(0.05, 2000.0, numEvaluations)
+    SL = np.random.RandomState(3).uniform(0.5, 0.999, numEvaluations)
+    return timeIt(lambda: GPoissonInvVec(SL, theta), numEvaluations)
+
+def peakMemory(func):
+    #Returns (result, peak MB allocated while running func)
+    tracemalloc.start()
+    try:
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, peak/2.0**20
+
+def monteCarloBenchmarks(baseData, numTrials, numScalarTrials=20):
+    '''
+    Times the Monte-Carlo pipeline end to end and checks the low memory and
+    parallel evaluators against the original evaluateCases/recalculateSummary
+
+    OUTPUT
+    list of (pipeline, trials per second, peak MB, max error), the error is
+    None for the original pipeline, which is the reference
+    '''
+    rows = []
+    numParts = len(baseData)
+
+    #Original pipeline on a few trials, its cases are rebuilt for the check
+    cases = regenerateCases(baseData, numScalarTrials, np.arange(numScalarTrials))
+    def originalPipeline():
+        mc = monteCarlo
+        results = np.empty((numParts, numScalarTrials, 4))
+        summary = np.zeros((numScalarTrials, 5))
+        mc.evaluateCases(baseData, cases, results, summary, 4)
+        summaryUW = np.zeros((numScalarTrials, 5))
+        mc.recalculateSummary(baseData, cases, results, summaryUW, 6)
+        return summary
+
+    #Compile on a single part first so a numba failure is found cheaply
+    def compileCheck():
+        evaluateCases(baseData[:1], cases[:1,:1], np.empty((1, 1, 4)), np.zeros((1, 5)), 4)
+        recalculateSummary(baseData[:1], cases[:1,:1], np.empty((1, 1, 4)), np.zeros((1, 5)), 6)
+    mode, kernels = kernelMode(compileCheck)
+    name = 'evaluateCases' if mode == 'jit' else 'evaluateCases-py'
+
+    start = time.time()
+    try:
+        with kernels():
+            original, peak = peakMemory(originalPipeline)
+        rows.append((name, numScalarTrials/(time.time() - start), peak, None))
+    except Exception as e:
+        print("    evaluateCases failed: %s" % str(e).splitlines()[0])
+        original = None
+        rows.append((name, None, np.nan, None))
+
+    lowMem = evaluateCasesLowMem(baseData, numScalarTrials)[0]
+    check = np.nan if original is None else np.abs(original - lowMem).max()
+
+    start = time.time()
+    _, peak = peakMemory(lambda: evaluateCasesLowMem(baseData, numTrials))
+    rows.append(('evaluateCasesLowMem', numTrials/(time.time() - start), peak, check))
+
+    start = time.time()
+    parallel = evaluateCasesParallel(baseData, numTrials)
+    elapsed = time.time() - start
+    rows.append(('evaluateCasesParallel', numTrials/elapsed, np.nan, \
+                 np.abs(parallel - evaluateCasesLowMem(baseData, numTrials)).max()))
+
+    return rows
+
+def formatRate(rate):
+    return 'failed' if rate is None else '%.3g' % rate
+
+def checkStatus(rate, error, limit, allowSkipped):
+    '''
+    Returns '' for a passing check, 'FAIL' when the error is over the limit
+    and, when the check could not be run, 'SKIP' if allowed or 'FAIL'
+    '''
+    if rate is None or (error is not None and np.isnan(error)):
+        return 'SKIP' if allowSkipped else 'FAIL'
+    if error is not None and error > limit:
+        return 'FAIL'
+    return ''
+
+def formatError(error):
+    return '%10s' % '-' if error is None else '%10.2e' % error
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the inventory kernels and Monte-Carlo pipeline')
+    parser.add_argument('--trials', type=int, default=20000, help='Monte-Carlo trials per pipeline run')
+    parser.add_argument('--evaluations', type=int, default=100000, help='policies per array kernel call')
+    parser.add_argument('--allow-skipped', action='store_true', help='do not fail on checks that could not be run')
+    args = parser.parse_args()
+
+    failed = False
+
+    print("%-8s %-7s %-9s %14s %10s" % ('Regime', 'Branch', 'Kernel', 'Evals/sec', 'Max Error'))
+    for regime, branch, kernel, rate, error in kernelBenchmarks(args.evaluations):
+        status = checkStatus(rate, error, tolerance, args.allow_skipped)
+        failed = failed or (status == 'FAIL')
+        print("%-8s %-7s %-9s %14s %s %s" % (regime, branch, kernel, formatRate(rate), formatError(error), status))
+
+    inversionRate = inversionBenchmark(args.evaluations)
+    failed = failed or (inversionRate is None and not args.allow_skipped)
+    print("\nGPoissonInvVec: %s inversions/sec" % formatRate(inversionRate))
+
+    baseData = loadBaseData()
+    print("\n%-22s %14s %10s %10s" % ('Pipeline', 'Trials/sec', 'Peak MB', 'Max Error'))
+    for pipeline, rate, peak, error in monteCarloBenchmarks(baseData, args.trials):
+        status = checkStatus(rate, error, tolerance*1E4, args.allow_skipped)
+        failed = failed or (status == 'FAIL')
+        print("%-22s %14s %10.1f %s %s" % (pipeline, formatRate(rate), peak, formatError(error), status))
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,145 @@
+import numpy as np
+from inventoryManagement import *
+from monteCarlo import caseBounds
+
+#Finds the inventory investment vs. weighted fill rate frontier directly by
+#greedy marginal analysis. Every part's (r, Q) grid is reduced to its
+#efficient (concave) hull of investment vs. fill rate; walking all hull
+#segments in order of decreasing fill rate gained per dollar then traces the
+#Lagrangian frontier for the whole catalogue in a single sort.
+
+def efficientHull(investment, fillRate):
+    '''
+    Returns the indices of the points on the upper-left concave hull of
+    fill rate vs. investment, ordered by increasing investment
+    '''
+    order = np.lexsort((-fillRate, investment))
+
+    #Pareto front: more investment must buy more fill rate
+    front = []
+    best = -np.inf
+    for i in order:
+        if fillRate[i] > best:
+            front.append(i)
+            best = fillRate[i]
+
+    #Concave hull of the front
+    hull = []
+    for i in front:
+        while len(hull) >= 2:
+            i0, i1 = hull[-2], hull[-1]
+            cross = (investment[i1] - investment[i0])*(fillRate[i] - fillRate[i0]) - \
+                    (fillRate[i1] - fillRate[i0])*(investment[i] - investment[i0])
+            if cross >= 0:
+                hull.pop()
+            else:
+                break
+        hull.append(i)
+
+    return np.array(hull, dtype=np.int64)
+
+def efficientPartPolicies(baseData, iForWeighting=4, bounds=None):
+    '''
+    Evaluates every (r, Q) in each part's search range and keeps the policies
+    on the part's efficient hull
+
+    INPUT
+    baseData: part data, see the column listing in monteCarlo
+    iForWeighting: baseData column the fill rate is weighted by
+    bounds: tuple (rLow, rHigh, qLow, qHigh) of half-open per-part ranges,
+            defaults to the ranges used by generateCases
+
+    OUTPUT
+    list with one array of shape (numPolicies, 4) per part holding r, Q,
+    investment and weighted fill rate, ordered by increasing investment
+    '''
+    if bounds is None:
+        bounds = caseBounds(baseData)
+    rLow, rHigh, qLow, qHigh = bounds
+
+    partPolicies = []
+    for i in range(len(baseData)):
+        r, Q = np.meshgrid(np.arange(rLow[i], rHigh[i]), np.arange(qLow[i], qHigh[i]), indexing='ij')
+        r = r.ravel()
+        Q = Q.ravel()
+        table = PoissonTable(baseData[i,3], min(0, r.min()), (r + Q).max())
+
+        fillRate = np.minimum(1, table.SPoisson(Q, r))*baseData[i,iForWeighting]
+        investment = table.IPoisson(Q, r, table.BPoisson(Q, r))*baseData[i,1]
+
+        hull = efficientHull(investment, fillRate)
+        partPolicies.append(np.column_stack((r[hull], Q[hull], investment[hull], fillRate[hull])))
+
+    return partPolicies
+
+def traceFrontier(partPolicies):
+    '''
+    Traces the efficient frontier by moving one part at a time to the next
+    policy on its hull, always taking the move with the most fill rate per
+    dollar of investment
+
+    OUTPUT
+    tuple (investment, fillRate, parts) where investment[k] and fillRate[k]
+    are the totals after k moves and parts[k] is the part moved by move k+1
+    '''
+    parts = np.concatenate([ np.full(len(p) - 1, i, dtype=np.int64) for i, p in enumerate(partPolicies) ])
+    dInvestment = np.concatenate([ np.diff(p[:,2]) for p in partPolicies ])
+    dFillRate = np.concatenate([ np.diff(p[:,3]) for p in partPolicies ])
+
+    #Hull slopes decrease along each part, so a stable sort keeps every
+    #part's moves in order
+    with np.errstate(divide='ignore'):
+        slope = dFillRate/dInvestment
+    order = np.argsort(-slope, kind='mergesort')
+
+    investment = np.concatenate(([sum(p[0,2] for p in partPolicies)], dInvestment[order]))
+    fillRate = np.concatenate(([sum(p[0,3] for p in partPolicies)], dFillRate[order]))
+
+    return np.cumsum(investment), np.cumsum(fillRate), parts[order]
+
+def frontierPolicy(partPolicies, parts, step):
+    '''
+    Returns the (r, Q) of every part after the first step moves of the frontier
+    '''
+    position = np.bincount(parts[:step], minlength=len(partPolicies))
+    r = np.array([ p[k,0] for p, k in zip(partPolicies, position) ])
+    Q = np.array([ p[k,1] for p, k in zip(partPolicies, position) ])
+
+    return r, Q
+
+def findMinInvestmentPolicy(baseData, targetFillRate, iForWeighting=4, bounds=None):
+    '''
+    Finds the policy with the lowest inventory investment that meets the target
+    weighted fill rate
+
+    OUTPUT
+    tuple (r, Q, investment, fillRate), r and Q hold the policy of each part
+    '''
+    return findEfficientFrontier(baseData, [targetFillRate], iForWeighting, bounds)[0]
+
+def findEfficientFrontier(baseData, targetFillRates, iForWeighting=4, bounds=None):
+    '''
+    Finds the lowest investment policy for each of the target weighted fill
+    rates. Targets beyond the reach of the search ranges get the highest fill
+    rate policy.
+
+    INPUT
+    baseData: part data, see the column listing in monteCarlo
+    targetFillRates: weighted fill rates to find policies for
+    iForWeighting: baseData column the fill rate is weighted by
+    bounds: tuple (rLow, rHigh, qLow, qHigh) of half-open per-part ranges,
+            defaults to the ranges used by generateCases
+
+    OUTPUT
+    list of tuples (r, Q, investment, fillRate), one per target
+    '''
+    partPolicies = efficientPartPolicies(baseData, iForWeighting, bounds)
+    investment, fillRate, parts = traceFrontier(partPolicies)
+
+    policies = []
+    for target in targetFillRates:
+        step = min(np.searchsorted(fillRate, target), len(fillRate) - 1)
+        r, Q = frontierPolicy(partPolicies, parts, step)
+        policies.append((r, Q, investment[step], fillRate[step]))
+
+    return policies
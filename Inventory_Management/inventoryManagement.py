@@ -1,13 +1,10 @@
+import collections
 import numpy as np
 import scipy.special as sp
 import numba
 
 maxArg = 700
-<<<<<<< HEAD
 eps = 1E-10
-=======
-eps = 1e-10
->>>>>>> origin/master
 
 @numba.jit
 def gammaP(a, x):
@@ -112,15 +109,232 @@ def BPoisson(Q, r, theta):
 def IPoisson(Q, r, theta, B):
     return float(Q + 1) / 2 + r - theta + B
 
-@numba.jit
 def GPoissonInv(SL, theta):
-    r = 0
-    
-    CR = GPoisson(r, theta)
-    
-    while CR <= (SL-eps):
-        r += 1
-        CR = GPoisson(r, theta)
-        
-    return r
-    
+    return int(GPoissonInvVec(SL, theta))
+
+################################################################################
+
+#Array versions of the functions above. Each one broadcasts over NumPy arrays
+#of Q, r and theta and matches its scalar counterpart element by element.
+
+################################################################################
+
+def gZeroVec(r, theta):
+    r, theta = np.broadcast_arrays(np.asarray(r, dtype=float), np.asarray(theta, dtype=float))
+    out = sp.gammainc(np.maximum(r, 0) + 1, theta)
+    out = np.where(r == 0, np.where(theta > maxArg, 1., -np.expm1(-theta)), out)
+    return np.where(r < 0, 1., out)
+
+def BigGVec(r, theta):
+    r, theta = np.broadcast_arrays(np.asarray(r, dtype=float), np.asarray(theta, dtype=float))
+    out = sp.gammaincc(np.maximum(r, 0) + 1, theta)
+    out = np.where(r == 0, np.where(theta > maxArg, 0., np.exp(-theta)), out)
+    return np.where(r < 0, 0., out)
+
+def littleGVec(r, theta):
+    r, theta = np.broadcast_arrays(np.asarray(r, dtype=float), np.asarray(theta, dtype=float))
+    rPos = np.maximum(r, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        arg = sp.xlogy(rPos, theta) - theta - sp.gammaln(rPos + 1)
+    out = np.where(arg < -maxArg, 0., np.exp(arg))
+    return np.where(r < 0, 0., out)
+
+def gee1Vec(r, theta):
+    r, theta = np.broadcast_arrays(np.asarray(r, dtype=float), np.asarray(theta, dtype=float))
+    out = -(r - theta)*gZeroVec(r, theta) + theta*littleGVec(r, theta)
+    return np.where(r <= 0, theta, out)
+
+def gee2Vec(r, theta):
+    r, theta = np.broadcast_arrays(np.asarray(r, dtype=float), np.asarray(theta, dtype=float))
+    out = (((r - theta)**2 + r)*gZeroVec(r, theta) - theta*(r - theta)*littleGVec(r, theta))/2
+    return np.where(r <= 0, theta*theta/2, out)
+
+def GPoissonVec(r, theta):
+    return BigGVec(r, theta)
+
+def SPoissonVec(Q, r, theta):
+    '''
+    Fill rate for arrays of Q, r and theta. For r < 0 the scalar version sums
+    gZero(i - 1) over i = r+1..r+Q; the terms with i - 1 < 0 are all one and the
+    rest telescope to theta - gee1(r + Q), so no loop is needed.
+    '''
+    Q, r, theta = np.broadcast_arrays(np.asarray(Q, dtype=float), np.asarray(r, dtype=float),
+                                      np.asarray(theta, dtype=float))
+    rQ = r + Q
+    gRQ = gee1Vec(np.maximum(rQ, 0), theta)
+    abarPos = (gee1Vec(r, theta) - gRQ)/Q
+    abarNeg = (np.minimum(Q, -r) + np.where(rQ > 0, theta - gRQ, 0.))/Q
+    return 1 - np.where(r < 0, abarNeg, abarPos)
+
+def BPoissonVec(Q, r, theta):
+    '''
+    Backorder level for arrays of Q, r and theta. For r < 0 the scalar version
+    sums gee1(i) over i = r+1..r+Q; the terms with i <= 0 are all theta and the
+    rest telescope to gee2(0) - gee2(r + Q).
+    '''
+    Q, r, theta = np.broadcast_arrays(np.asarray(Q, dtype=float), np.asarray(r, dtype=float),
+                                      np.asarray(theta, dtype=float))
+    rQ = r + Q
+    gRQ = gee2Vec(np.maximum(rQ, 0), theta)
+    bbarPos = (gee2Vec(r, theta) - gRQ)/Q
+    bbarNeg = (np.minimum(Q, -r)*theta + np.where(rQ > 0, theta*theta/2 - gRQ, 0.))/Q
+    return np.where(r < 0, bbarNeg, bbarPos)
+
+def IPoissonVec(Q, r, theta, B):
+    return (np.asarray(Q, dtype=float) + 1)/2 + r - theta + B
+
+def GPoissonInvVec(SL, theta):
+    '''
+    Smallest r >= 0 with GPoisson(r, theta) > SL - eps for arrays of service
+    levels and thetas. Starts from a normal approximation of the Poisson
+    quantile, brackets the answer by doubling steps and bisects on the CDF, so
+    the cost grows with log(theta) rather than theta. Raises ValueError on
+    NaN or infinite inputs, which could never be bracketed.
+    '''
+    SL, theta = np.broadcast_arrays(np.asarray(SL, dtype=float), np.asarray(theta, dtype=float))
+    if np.any(SL > 1):
+        raise ValueError("Service level must not exceed 1")
+    if not (np.all(np.isfinite(SL)) and np.all(np.isfinite(theta))):
+        raise ValueError("Service levels and thetas must be finite")
+    if np.any(theta < 0):
+        raise ValueError("Theta must not be negative")
+    shape = SL.shape
+    SL = SL.ravel()
+    theta = theta.ravel()
+
+    def met(r):
+        return GPoissonVec(r, theta) > SL - eps
+
+    #Normal approximation with a skewness correction
+    z = sp.ndtri(np.clip(SL, 1E-12, 1 - 1E-12))
+    guess = np.maximum(0, np.floor(theta + z*np.sqrt(theta) + (z*z - 1)/6))
+    step = np.maximum(1, np.ceil(np.sqrt(theta)))
+
+    #Bracket with lo failing (or -1) and hi meeting the service level
+    lo = guess.copy()
+    hi = guess.copy()
+    atGuess = met(guess)
+    lo[atGuess] -= step[atGuess]
+    hi[~atGuess] += step[~atGuess]
+    for doubling in range(64):
+        down = (lo >= 0) & met(np.maximum(lo, 0))
+        up = ~met(hi)
+        if not (down.any() or up.any()):
+            break
+        step *= 2
+        hi[down] = lo[down]
+        lo[down] -= step[down]
+        lo[up] = hi[up]
+        hi[up] += step[up]
+    else:
+        raise RuntimeError("Could not bracket the service level")
+    lo = np.maximum(lo, -1)
+
+    #Bisect on the integers between the brackets
+    while np.any(hi - lo > 1):
+        mid = np.where(hi - lo > 1, np.floor((lo + hi)/2), hi)
+        midMet = met(mid)
+        hi = np.where(midMet, mid, hi)
+        lo = np.where(midMet, lo, mid)
+
+    return hi.astype(np.int64).reshape(shape)
+
+################################################################################
+
+#Lookup tables for a fixed theta. gZero, gee1, gee2 and BigG are computed once
+#over a range of integer r, after which the Poisson metrics for any integer
+#(r, Q) within that range are table lookups and differences.
+
+################################################################################
+
+class PoissonTable(object):
+    def __init__(self, theta, rMin, rMax):
+        '''
+        Tabulates the Poisson functions for integer r in [rMin, rMax]. A
+        policy (r, Q) can be looked up when rMin <= r and r + Q <= rMax.
+        '''
+        self.theta = float(theta)
+        self.rMin = int(rMin)
+        self.rMax = int(rMax)
+
+        r = np.arange(self.rMin, self.rMax + 1)
+        self.gZero = gZeroVec(r, self.theta)
+        self.BigG = BigGVec(r, self.theta)
+        self.gee1 = gee1Vec(r, self.theta)
+        self.gee2 = gee2Vec(r, self.theta)
+
+        #Prefix sums for the r < 0 branches of SPoisson and BPoisson
+        self.gZeroSum = np.concatenate(([0.], np.cumsum(self.gZero)))
+        self.gee1Sum = np.concatenate(([0.], np.cumsum(self.gee1)))
+
+    def __len__(self):
+        return self.rMax - self.rMin + 1
+
+    def covers(self, rMin, rMax):
+        return (self.rMin <= rMin) and (rMax <= self.rMax)
+
+    def index(self, r):
+        i = np.asarray(r).astype(np.int64) - self.rMin
+        if (i.size > 0) and ((i.min() < 0) or (i.max() >= len(self))):
+            raise ValueError("r outside of table range [%d, %d]" % (self.rMin, self.rMax))
+        return i
+
+    def GPoisson(self, r):
+        return self.BigG[self.index(r)]
+
+    def SPoisson(self, Q, r):
+        Q = np.asarray(Q, dtype=float)
+        iR = self.index(r)
+        iRQ = self.index(np.asarray(r) + Q)
+        #Sum of gZero(i - 1) for i = r+1..r+Q, which covers table rows r..r+Q-1
+        abarNeg = (self.gZeroSum[iRQ] - self.gZeroSum[iR])/Q
+        abarPos = (self.gee1[iR] - self.gee1[iRQ])/Q
+        return 1 - np.where(np.asarray(r) < 0, abarNeg, abarPos)
+
+    def BPoisson(self, Q, r):
+        Q = np.asarray(Q, dtype=float)
+        iR = self.index(r)
+        iRQ = self.index(np.asarray(r) + Q)
+        #Sum of gee1(i) for i = r+1..r+Q
+        bbarNeg = (self.gee1Sum[iRQ + 1] - self.gee1Sum[iR + 1])/Q
+        bbarPos = (self.gee2[iR] - self.gee2[iRQ])/Q
+        return np.where(np.asarray(r) < 0, bbarNeg, bbarPos)
+
+    def IPoisson(self, Q, r, B):
+        return IPoissonVec(Q, r, self.theta, B)
+
+class PoissonTableCache(object):
+    def __init__(self, maxTables=512, maxTableSize=10**6):
+        '''
+        Keeps the most recently used PoissonTables, one per key (e.g. the part
+        index). At most maxTables tables are kept and ranges longer than
+        maxTableSize are never tabulated, so parts with very large theta fall
+        back to the array functions.
+        '''
+        self.maxTables = maxTables
+        self.maxTableSize = maxTableSize
+        self.tables = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.tables)
+
+    def get(self, key, theta, rMin, rMax):
+        '''
+        Returns a table for key covering [rMin, rMax], building it if needed,
+        or None when the range is longer than maxTableSize
+        '''
+        if rMax - rMin + 1 > self.maxTableSize:
+            return None
+
+        table = self.tables.pop(key, None)
+        if (table is None) or (table.theta != theta) or not table.covers(rMin, rMax):
+            table = PoissonTable(theta, rMin, rMax)
+
+        self.tables[key] = table
+        while len(self.tables) > self.maxTables:
+            self.tables.popitem(last=False)
+
+        return table
+
+    def clear(self):
+        self.tables.clear()
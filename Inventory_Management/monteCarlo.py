@@ -0,0 +1,300 @@
+import multiprocessing
+import numpy as np
+import numba
+from inventoryManagement import *
+
+#Columns of baseData used by the Monte-Carlo functions
+# 0=Part index, 1=Unit Cost, 2=Daily Demand, 3=theta, 4=Sales Weight,
+# 5=Units Weight, 6=Unweighted, 7=sqrt(theta)
+
+@numba.jit
+def generateCases(baseData, numTrials, cases):
+    numParts = len(baseData)
+    for i in range(numParts):
+        cases[i,:,0] = np.random.randint(int(max(0, np.floor(baseData[i,3] - 2.5*baseData[i,7]))), \
+                                         int(max(1, np.ceil(baseData[i,3] + 2.5*baseData[i,7]))), \
+                                         numTrials)
+
+        cases[i,:,1] = np.random.randint(1, int(max(2, 3*baseData[i,3])), numTrials)
+
+@numba.jit
+def evaluateCases(baseData, cases, results, summary, iForWeighting):
+    step = max(1, cases.shape[0]//20)
+    for i in range(cases.shape[0]):
+        #Print status
+        if i%step == 0:
+            print("%d percent complete" % (float(i)*100/cases.shape[0]))
+        #Calculate inventory metrics
+        for j in range(cases.shape[1]):
+            results[i,j,0] = GPoisson(cases[i,j,0], baseData[i,3])
+            summary[j,0] += results[i,j,0]*baseData[i,iForWeighting]
+            results[i,j,1] = min(1,SPoisson(cases[i,j,1], cases[i,j,0], baseData[i,3]))
+            summary[j,1] += results[i,j,1]*baseData[i,iForWeighting]
+            results[i,j,2] = BPoisson(cases[i,j,1], cases[i,j,0], baseData[i,3])
+            summary[j,2] += results[i,j,2]*baseData[i,iForWeighting]
+            results[i,j,3] = IPoisson(cases[i,j,1], cases[i,j,0], baseData[i,3], results[i,j,2])
+            summary[j,3] += results[i,j,3]*baseData[i,1]
+            summary[j,4] += baseData[i,2]*365.0/cases[i,j,1]*baseData[i,iForWeighting]
+
+@numba.jit
+def recalculateSummary(baseData, cases, results, summary, iForWeighting):
+    for i in range(cases.shape[0]):
+        for j in range(cases.shape[1]):
+            summary[j,0] += results[i,j,0]*baseData[i,iForWeighting]
+            summary[j,1] += results[i,j,1]*baseData[i,iForWeighting]
+            summary[j,2] += results[i,j,2]*baseData[i,iForWeighting]
+            summary[j,3] += results[i,j,3]*baseData[i,1]
+            summary[j,4] += baseData[i,2]*365.0/cases[i,j,1]*baseData[i,iForWeighting]
+
+def caseBounds(baseData):
+    '''
+    Returns the half-open ranges generateCases draws r and Q from for each part
+
+    OUTPUT
+    tuple of integer arrays (rLow, rHigh, qLow, qHigh)
+    '''
+    theta = baseData[:,3]
+    rLow = np.maximum(0, np.floor(theta - 2.5*baseData[:,7])).astype(np.int64)
+    rHigh = np.maximum(1, np.ceil(theta + 2.5*baseData[:,7])).astype(np.int64)
+    qLow = np.ones(len(baseData), dtype=np.int64)
+    qHigh = np.maximum(2, 3*theta).astype(np.int64)
+
+    return rLow, rHigh, qLow, qHigh
+
+def generateCasesChunk(baseData, numTrials, randomState):
+    '''
+    Draws numTrials (r, Q) policies for every part from randomState using the
+    same bounds as generateCases
+
+    OUTPUT
+    array of shape (numParts, numTrials, 2) holding r and Q
+    '''
+    rLow, rHigh, qLow, qHigh = caseBounds(baseData)
+    cases = np.empty((len(baseData), numTrials, 2))
+    for i in range(len(baseData)):
+        cases[i,:,0] = randomState.randint(rLow[i], rHigh[i], numTrials)
+        cases[i,:,1] = randomState.randint(qLow[i], qHigh[i], numTrials)
+
+    return cases
+
+def uniformSampler(method, dimension, seed=0):
+    '''
+    Returns a function drawing n points of the unit hypercube at a time
+
+    INPUT
+    method: 'lhs' for Latin hypercube sampling (each call is its own design),
+            'sobol' or 'halton' for scrambled low-discrepancy sequences that
+            continue from one call to the next, ideally in powers of two
+    dimension: number of coordinates per point
+    seed: seed of the scrambling or permutations
+    '''
+    if method == 'lhs':
+        randomState = np.random.RandomState(seed)
+        def draw(n):
+            strata = np.argsort(randomState.rand(n, dimension), axis=0)
+            return (strata + randomState.rand(n, dimension))/n
+        return draw
+    elif method in ('sobol', 'halton'):
+        from scipy.stats import qmc
+        engine = qmc.Sobol if method == 'sobol' else qmc.Halton
+        return engine(dimension, scramble=True, seed=seed).random
+    else:
+        raise ValueError("Unknown sampling method %s" % method)
+
+def casesFromUniform(baseData, u):
+    '''
+    Maps points u of shape (numTrials, 2*numParts) in the unit hypercube onto
+    the (r, Q) ranges of generateCases, one pair of coordinates per part
+
+    OUTPUT
+    array of shape (numParts, numTrials, 2) holding r and Q
+    '''
+    rLow, rHigh, qLow, qHigh = caseBounds(baseData)
+    numParts = len(baseData)
+    cases = np.empty((numParts, len(u), 2))
+    cases[:,:,0] = np.minimum(rLow[:,None] + np.floor(u[:,:numParts].T*(rHigh - rLow)[:,None]), rHigh[:,None] - 1)
+    cases[:,:,1] = np.minimum(qLow[:,None] + np.floor(u[:,numParts:].T*(qHigh - qLow)[:,None]), qHigh[:,None] - 1)
+
+    return cases
+
+def chunkRandomState(seed, iChunk):
+    #Each chunk gets its own stream so any chunk can be regenerated on its own
+    return np.random.RandomState([seed, iChunk])
+
+def evaluateChunk(baseData, cases, summaries, weightings, tables=None):
+    '''
+    Evaluates a block of cases one part at a time, adding each part's
+    contribution straight into the per-trial summary rows for every weighting
+
+    INPUT
+    baseData: part data, see the column listing at the top of this module
+    cases: array of shape (numParts, numTrials, 2) holding r and Q
+    summaries: array of shape (len(weightings), numTrials, 5), updated in place
+    weightings: baseData columns to weight the averages by
+    tables: optional PoissonTableCache, parts are looked up in their table
+            instead of evaluating the incomplete gamma functions
+    '''
+    if tables is not None:
+        rLow, rHigh, qLow, qHigh = caseBounds(baseData)
+
+    for i in range(len(baseData)):
+        r = cases[i,:,0]
+        Q = cases[i,:,1]
+        theta = baseData[i,3]
+
+        table = None
+        if tables is not None:
+            rMin = min(rLow[i], r.min())
+            rMax = max(rHigh[i] + qHigh[i] - 2, (r + Q).max())
+            table = tables.get(i, theta, rMin, rMax)
+
+        if table is not None:
+            sl = table.GPoisson(r)
+            fr = np.minimum(1, table.SPoisson(Q, r))
+            bo = table.BPoisson(Q, r)
+        else:
+            sl = GPoissonVec(r, theta)
+            fr = np.minimum(1, SPoissonVec(Q, r, theta))
+            bo = BPoissonVec(Q, r, theta)
+        investment = IPoissonVec(Q, r, theta, bo)*baseData[i,1]
+        orderFreq = baseData[i,2]*365.0/Q
+
+        for k, iForWeighting in enumerate(weightings):
+            w = baseData[i,iForWeighting]
+            summaries[k,:,0] += sl*w
+            summaries[k,:,1] += fr*w
+            summaries[k,:,2] += bo*w
+            summaries[k,:,3] += investment
+            summaries[k,:,4] += orderFreq*w
+
+def evaluateCasesLowMem(baseData, numTrials, seed=0, chunkSize=10000, weightings=(4, 5, 6), tables=None, sampling='random'):
+    '''
+    Generates and evaluates numTrials random (r, Q) policies in chunks of
+    chunkSize trials, so neither the cases nor the per-part results are ever
+    held for the whole run. The summaries for every weighting are built in
+    the same pass.
+
+    INPUT
+    baseData: part data, see the column listing at the top of this module
+    numTrials: number of policies to evaluate
+    seed: seed of the run, the cases of any trial can be rebuilt from it with
+          regenerateCases
+    chunkSize: number of trials generated and evaluated at once
+    weightings: baseData columns to weight the averages by, defaults to
+                sales, units and unweighted
+    tables: PoissonTableCache holding the per-part lookup tables, a new one
+            is made for the run when not given
+    sampling: 'random' for independent draws as in generateCases, or 'lhs',
+              'sobol' or 'halton' to spread the cases with uniformSampler,
+              which covers the policy space with far fewer trials
+
+    OUTPUT
+    array of shape (len(weightings), numTrials, 5) with the same columns as
+    the summary filled by evaluateCases
+    '''
+    summaries = np.zeros((len(weightings), numTrials, 5))
+    if tables is None:
+        tables = PoissonTableCache()
+    if sampling != 'random':
+        draw = uniformSampler(sampling, 2*len(baseData), seed)
+
+    for iChunk, start in enumerate(range(0, numTrials, chunkSize)):
+        stop = min(start + chunkSize, numTrials)
+        if sampling == 'random':
+            cases = generateCasesChunk(baseData, stop - start, chunkRandomState(seed, iChunk))
+        else:
+            cases = casesFromUniform(baseData, draw(stop - start))
+        evaluateChunk(baseData, cases, summaries[:,start:stop], weightings, tables)
+
+    return summaries
+
+def regenerateCases(baseData, numTrials, trials, seed=0, chunkSize=10000):
+    '''
+    Rebuilds the (r, Q) policies of the given trial numbers of a run of
+    evaluateCasesLowMem with the same numTrials, seed and chunkSize and
+    random sampling
+
+    OUTPUT
+    array of shape (numParts, len(trials), 2) holding r and Q
+    '''
+    trials = np.asarray(trials, dtype=np.int64)
+    cases = np.empty((len(baseData), len(trials), 2))
+    for iChunk in np.unique(trials//chunkSize):
+        inChunk = (trials//chunkSize) == iChunk
+        start = iChunk*chunkSize
+        chunkCases = generateCasesChunk(baseData, min(chunkSize, numTrials - start), chunkRandomState(seed, iChunk))
+        cases[:,inChunk] = chunkCases[:,trials[inChunk] - start]
+
+    return cases
+
+#Per-process state of the workers used by evaluateCasesParallel
+_workerData = {}
+
+def _initWorker(baseData, weightings, seed):
+    _workerData['baseData'] = baseData
+    _workerData['weightings'] = weightings
+    _workerData['seed'] = seed
+    _workerData['tables'] = PoissonTableCache()
+
+def _evaluateChunkJob(job):
+    iChunk, numTrials = job
+    baseData = _workerData['baseData']
+    weightings = _workerData['weightings']
+
+    summaries = np.zeros((len(weightings), numTrials, 5))
+    cases = generateCasesChunk(baseData, numTrials, chunkRandomState(_workerData['seed'], iChunk))
+    evaluateChunk(baseData, cases, summaries, weightings, _workerData['tables'])
+
+    return iChunk, summaries
+
+def evaluateCasesParallel(baseData, numTrials, seed=0, chunkSize=10000, weightings=(4, 5, 6), numWorkers=None):
+    '''
+    Parallel version of evaluateCasesLowMem. Chunks are spread over a pool of
+    numWorkers processes, each chunk drawing from its own (seed, chunk) random
+    stream, and the chunk summaries are written back by chunk number. The
+    result is therefore identical to evaluateCasesLowMem with the same seed
+    and chunkSize, whatever the number of workers.
+
+    INPUT
+    baseData: part data, see the column listing at the top of this module
+    numTrials: number of policies to evaluate
+    seed: seed of the run
+    chunkSize: number of trials handed to a worker at once
+    weightings: baseData columns to weight the averages by
+    numWorkers: number of processes, defaults to the number of cores
+
+    OUTPUT
+    array of shape (len(weightings), numTrials, 5)
+    '''
+    summaries = np.zeros((len(weightings), numTrials, 5))
+    jobs = [ (iChunk, min(chunkSize, numTrials - start)) for iChunk, start in enumerate(range(0, numTrials, chunkSize)) ]
+
+    pool = multiprocessing.Pool(numWorkers, _initWorker, (baseData, tuple(weightings), seed))
+    try:
+        for iChunk, chunkSummaries in pool.imap_unordered(_evaluateChunkJob, jobs):
+            start = iChunk*chunkSize
+            summaries[:,start:start + chunkSummaries.shape[1]] = chunkSummaries
+    finally:
+        pool.close()
+        pool.join()
+
+    return summaries
+
+def frontierConvergence(summary, trialCounts, targetFillRate):
+    '''
+    Tracks how the best policy found improves with the number of trials, to
+    compare sampling methods
+
+    INPUT
+    summary: per-trial summary for one weighting, as built by evaluateCases
+    trialCounts: increasing numbers of trials to report at
+    targetFillRate: weighted fill rate the policy must reach
+
+    OUTPUT
+    array holding, for each count, the lowest investment among the first
+    trials reaching the target, inf when none of them do
+    '''
+    investment = np.where(summary[:,1] >= targetFillRate, summary[:,3], np.inf)
+    bestSoFar = np.minimum.accumulate(investment)
+
+    return bestSoFar[np.asarray(trialCounts) - 1]
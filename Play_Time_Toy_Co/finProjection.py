@@ -1,4 +1,8 @@
+import collections
+import itertools
+import multiprocessing
 import numpy as np
+import pandas as pd
 
 def computeFS(fs, production, r_tax, r_debt, w_pay, t0_i, n_collec_per):
     '''
@@ -116,6 +120,367 @@ def computeFS(fs, production, r_tax, r_debt, w_pay, t0_i, n_collec_per):
             fs[6,i] = 175
             fs[11,i] = (fs[6,i] + fs[7,i] + fs[8,i] + fs[9,1]) - \
             (fs[10,i] + fs[12,i] + fs[13,i] + fs[14,i] + fs[15,i])
+
+def computeFSBatch(fs, production, r_tax, r_debt, w_pay, t0_i, n_collec_per):
+    '''
+    Same as computeFS for many trials at once, advancing every trial a
+    month at a time. The notes payable branch becomes a per-trial mask.
+
+    fs -->  A (16,n,numTrials) array, fs[:,:,k] is laid out as the fs
+            of computeFS for trial k
+
+    production -->  A (n-t0_i,numTrials) array with the production
+                    schedule of each trial in its columns
+
+    r_tax, r_debt, w_pay -->  Scalars, or arrays of length numTrials
+                              with a value per trial
+
+    t0_i, n_collec_per -->  As in computeFS, shared by all trials
+
+    '''
+    for i in range(t0_i, fs.shape[1]):
+        month = (i-t0_i+1) % 12
+
+        #Calculate IS values
+        fs[3,i] = fs[0,i] - fs[1,i] - fs[2,i]
+        interest = fs[11,i-1]*r_debt
+        fs[4,i] = r_tax*(fs[3,i] - interest)
+        fs[5,i] = fs[3,i] - interest - fs[4,i]
+
+        #Calculate BS values
+        fs[7,i] = fs[7,i-1] - fs[0,i-n_collec_per] + fs[0,i]
+        fs[8,i] = fs[8,i-1] + production[i-t0_i] - fs[1,i]
+        fs[9,i] = fs[9,i-1]
+        fs[10,i] = w_pay*fs[0,i]
+        fs[12,i] = fs[12,i-1] + fs[4,i]
+
+        #Tax payments fall in the same months for every trial
+        if month == 3:
+            fs[12,i] -= fs[12,i-3]
+        if month in [4,9]:
+            fs[12,i] -= 31
+        elif month in [6,12]:
+            fs[12,i] -= 32
+
+        fs[13,i] = fs[13,i-1]
+        fs[14,i] = fs[14,i-1]
+        if (i-t0_i+1 == 6) or (i-t0_i+1 == 12):
+            fs[14,i] -= 25
+
+        fs[15,i] = fs[15,i-1] + fs[5,i]
+
+        fs[6,i] = fs[6,i-1] - \
+                  (fs[7,i] - fs[7,i-1]) -  \
+                  (fs[8,i] - fs[8,i-1]) -  \
+                  (fs[9,i] - fs[9,i-1]) +  \
+                  (fs[10,i] - fs[10,i-1]) + \
+                  (fs[12,i] - fs[12,i-1]) + \
+                  (fs[15,i] - fs[15,i-1])
+
+        #Pay down notes payable with cash above 175, borrow to get back to 175
+        surplus = fs[6,i] > 175.0
+        payDown = np.maximum(0, fs[11,i-1] - (fs[6,i] - 175))
+        borrow = (175 + fs[7,i] + fs[8,i] + fs[9,1]) - \
+                 (fs[10,i] + fs[12,i] + fs[13,i] + fs[14,i] + fs[15,i])
+        fs[11,i] = np.where(surplus, payDown, borrow)
+        fs[6,i] = np.where(surplus, fs[6,i] + (payDown - fs[11,i-1]), 175)
+
+#Extra statistics for computeFSSummary, name -> (initial, update, finish)
+summaryReducers = collections.OrderedDict()
+
+def registerReducer(name, update, initial=0.0, finish=None):
+    '''
+    Adds a statistic to the results of computeFSSummary
+
+    name -->     Field name in the results array
+
+    update -->   update(acc, column, month) returns the new accumulator
+                 given the (16,numTrials) statements of one month of the
+                 forecast, month counting from 0 at t0_i
+
+    initial -->  Starting value of the accumulator
+
+    finish -->   Optional finish(acc, numMonths) giving the final value
+
+    '''
+    summaryReducers[name] = (initial, update, finish)
+
+registerReducer('minInventory', lambda acc, column, month: np.minimum(acc, column[8]), initial=np.inf)
+registerReducer('minCash', lambda acc, column, month: np.minimum(acc, column[6]), initial=np.inf)
+
+def summaryDtype(reducers):
+    return np.dtype([('index', np.int64), \
+                     ('netProfit', np.float64), \
+                     ('avgDebt', np.float64), \
+                     ('maxDebt', np.float64), \
+                     ('avgInventory', np.float64), \
+                     ('inventoryTurns', np.float64)] + \
+                    [(name, np.float64) for name in reducers])
+
+def computeFSSummary(fs, production, r_tax, r_debt, w_pay, t0_i, n_collec_per, reducers=None, chunkSize=4096):
+    '''
+    Projects the statements of every production schedule with
+    computeFSBatch a chunk of trials at a time and keeps only summary
+    statistics, so the full (16,n,numTrials) statements never exist.
+
+    fs -->  A (16,n) array of starting statements, as in computeFS,
+            shared by all trials
+
+    production -->  A (n-t0_i,numTrials) array with the production
+                    schedule of each trial in its columns
+
+    reducers -->  Names of the registered reducers to add to the
+                  results, all of summaryReducers by default
+
+    chunkSize -->  Number of trials projected at once
+
+    The other arguments are as in computeFSBatch. Returns a structured
+    array with the dtCus statistics of the Play Time notebook (without
+    the production schedule) plus a field per reducer. As in the
+    notebook, avgInventory is a fraction of total COGS.
+
+    '''
+    if reducers is None:
+        reducers = list(summaryReducers)
+    numTrials = production.shape[1]
+    numMonths = fs.shape[1] - t0_i
+    results = np.empty(numTrials, dtype=summaryDtype(reducers))
+    results['index'] = np.arange(numTrials)
+
+    #COGS is given, so it is the same for every trial
+    totalCOGS = fs[1,t0_i:].sum()
+
+    chunk = np.empty(fs.shape + (min(chunkSize, numTrials),))
+    for start in range(0, numTrials, chunkSize):
+        stop = min(start + chunkSize, numTrials)
+        trials = chunk[:,:,:stop-start]
+        trials[:] = fs[:,:,None]
+        perTrial = [p[start:stop] if np.ndim(p) else p for p in (r_tax, r_debt, w_pay)]
+        computeFSBatch(trials, production[:,start:stop], perTrial[0], perTrial[1], perTrial[2], t0_i, n_collec_per)
+
+        out = results[start:stop]
+        out['netProfit'] = trials[5,t0_i:].sum(axis=0)
+        out['avgDebt'] = trials[11,t0_i:].mean(axis=0)
+        out['maxDebt'] = trials[11,t0_i:].max(axis=0)
+        avgInventory = trials[8,t0_i:].mean(axis=0)
+        out['inventoryTurns'] = totalCOGS/avgInventory
+        out['avgInventory'] = avgInventory/totalCOGS
+
+        for name in reducers:
+            initial, update, finish = summaryReducers[name]
+            acc = np.full(stop - start, initial, dtype=np.float64)
+            for month in range(numMonths):
+                acc = update(acc, trials[:,t0_i+month], month)
+            out[name] = acc if finish is None else finish(acc, numMonths)
+
+    return results
+
+def proposeSchedules(numSchedules, numMonths, randomState, concentration=None):
+    '''
+    Draws production schedules as fractions of total production. Without
+    concentration the months are normalized uniform draws, as in the Play
+    Time notebook. Otherwise half of the draws come from a Dirichlet with
+    the given concentration per month and half from the uniform proposal.
+    '''
+    schedules = randomState.rand(numSchedules, numMonths)
+    if concentration is not None:
+        fromDirichlet = randomState.rand(numSchedules) < 0.5
+        schedules[fromDirichlet] = randomState.dirichlet(concentration, fromDirichlet.sum())
+    return schedules/schedules.sum(axis=1)[:,None]
+
+def fitConcentration(schedules):
+    #Dirichlet concentration matching the mean and variance of the schedules
+    mean = schedules.mean(axis=0)
+    var = schedules.var(axis=0)
+    total = np.mean(mean*(1 - mean)/np.maximum(var, 1E-12)) - 1
+    return mean*max(total, 1.0)
+
+def sampleFeasibleSchedules(fs, totalProduction, numFeasible, r_tax, r_debt, w_pay, t0_i, n_collec_per, \
+                            minInventory=529.9999, maxDebt=1900.0, adaptive=False, blockSize=10000, \
+                            maxBlockSize=10**6, reducers=None, randomState=np.random):
+    '''
+    Draws random production schedules a block at a time, projects them
+    with computeFSSummary and keeps the ones that never let inventory fall
+    below minInventory or notes payable rise above maxDebt, until
+    numFeasible of them are found. Blocks are projected blockSize
+    schedules at a time and the search stops as soon as enough are
+    feasible. Later blocks are sized from the acceptance rate of the
+    current proposal.
+
+    totalProduction -->  Production over the forecast, the schedules
+                         split it between the months
+
+    adaptive -->  Fit a Dirichlet to the feasible schedules found so far
+                  and draw half of each later block from it. This cuts
+                  wasted projections but no longer samples the feasible
+                  schedules with the notebook's distribution.
+
+    The other arguments are as in computeFSSummary. Returns a tuple
+    (production, results, stats): the feasible schedules as fractions of
+    totalProduction in the rows of production, their computeFSSummary
+    results, and a dict with the number of schedules proposed up to the
+    last one used, the number accepted (numFeasible), their acceptance
+    rate, and the number projected in total, which includes the rest of
+    the last projected chunk.
+
+    '''
+    if reducers is None:
+        reducers = list(summaryReducers)
+    if 'minInventory' not in reducers:
+        reducers = list(reducers) + ['minInventory']
+    numMonths = fs.shape[1] - t0_i
+
+    accepted = []
+    acceptedResults = []
+    numAccepted = 0
+    numProposed = 0
+    numProjected = 0
+    concentration = None
+    size = blockSize
+    while numAccepted < numFeasible:
+        schedules = proposeSchedules(size, numMonths, randomState, concentration)
+        blockAccepted = 0
+
+        #Project the block blockSize schedules at a time, stopping as soon
+        #as enough schedules are feasible
+        for start in range(0, size, blockSize):
+            chunk = schedules[start:start+blockSize]
+            results = computeFSSummary(fs, totalProduction*chunk.T, r_tax, r_debt, w_pay, t0_i, n_collec_per, reducers)
+            feasible = (results['minInventory'] >= minInventory) & (results['maxDebt'] <= maxDebt)
+            numProjected += len(chunk)
+
+            #Only count the schedules up to the last feasible one used
+            used = np.flatnonzero(feasible)[:numFeasible - numAccepted]
+            if numAccepted + len(used) >= numFeasible:
+                numProposed += int(used[-1]) + 1
+            else:
+                numProposed += len(chunk)
+            numAccepted += len(used)
+            blockAccepted += len(used)
+            accepted.append(chunk[used])
+            acceptedResults.append(results[used])
+            if numAccepted >= numFeasible:
+                break
+
+        if numAccepted >= numFeasible:
+            break
+
+        if adaptive and numAccepted > 1:
+            #The refit proposal has an unknown acceptance rate, so it starts
+            #with a pilot block
+            concentration = fitConcentration(np.concatenate(accepted))
+            size = blockSize
+        else:
+            #Size the next block to finish, with some margin
+            rate = max(blockAccepted*1.0/size, 1.0/size)
+            size = int(min(maxBlockSize, 10*size, max(blockSize, 1.1*(numFeasible - numAccepted)/rate)))
+
+    production = np.concatenate(accepted)
+    results = np.concatenate(acceptedResults)
+    results['index'] = np.arange(numFeasible)
+
+    return production, results, {'proposed': numProposed, 'accepted': numAccepted, \
+                                 'acceptanceRate': numAccepted*1.0/numProposed, 'projected': numProjected}
+
+def scenarioGrid(**values):
+    '''
+    Returns a list of scenarios, one dict per combination of the given
+    values, e.g. scenarioGrid(r_tax=[0.3,0.34], n_collec_per=[1,2,3])
+    '''
+    names = sorted(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*[values[n] for n in names])]
+
+#Inputs of the scenario workers, production is attached from shared memory
+_workerData = {}
+
+def _initScenarioWorker(statements, shmName, shape, dtype, settings):
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shmName)
+    _workerData['shm'] = shm
+    _workerData['production'] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _workerData['statements'] = statements
+    _workerData['settings'] = settings
+
+def _scenarioJob(job):
+    iScenario, scenario = job
+    settings = _workerData['settings']
+    fs = _workerData['statements'][scenario.get('statement', 0)]
+    t0_i = settings['t0_i']
+
+    #Schedules are fractions of the forecast COGS of the scenario's sales
+    production = fs[1,t0_i:].sum()*_workerData['production']
+    results = computeFSSummary(fs, production, scenario['r_tax'], scenario['r_debt'], scenario['w_pay'], t0_i, \
+                               scenario['n_collec_per'], settings['reducers'])
+
+    row = {'feasible': np.mean((results['minInventory'] >= settings['minInventory']) & \
+                               (results['maxDebt'] <= settings['maxDebt']))}
+    for name in results.dtype.names[1:]:
+        row[name + ' mean'] = results[name].mean()
+        for q, value in zip(settings['quantiles'], np.percentile(results[name], 100*np.asarray(settings['quantiles']))):
+            row['%s q%g' % (name, q)] = value
+
+    return iScenario, row
+
+def runScenarios(statements, production, scenarios, t0_i, quantiles=(0.05, 0.5, 0.95), minInventory=529.9999, \
+                 maxDebt=1900.0, reducers=None, numWorkers=None):
+    '''
+    Projects every production schedule under every scenario on a process
+    pool and summarizes the distribution of the computeFSSummary results
+    of each scenario. The schedules are placed in shared memory once
+    instead of being copied to each worker.
+
+    statements -->  A (16,n) array of starting statements, as in
+                    computeFS, or a (numStatements,16,n) array of them,
+                    e.g. for different sales projections
+
+    production -->  A (n-t0_i,numSchedules) array of production
+                    schedules as fractions of the forecast COGS
+
+    scenarios -->  List of dicts with r_tax, r_debt, w_pay and
+                   n_collec_per, and optionally the index of the
+                   statement to start from, see scenarioGrid
+
+    minInventory, maxDebt -->  Limits of a feasible schedule, the
+                               fraction of feasible schedules is
+                               reported per scenario
+
+    Reducers are inherited by forked workers, so register them before
+    calling. Returns a DataFrame with a row per scenario holding its
+    parameters, the feasible fraction, and the mean and quantiles of
+    each statistic.
+
+    '''
+    statements = np.asarray(statements, dtype=np.float64)
+    if statements.ndim == 2:
+        statements = statements[None]
+    if reducers is None:
+        reducers = list(summaryReducers)
+    if 'minInventory' not in reducers:
+        reducers = list(reducers) + ['minInventory']
+    settings = {'t0_i': t0_i, 'quantiles': tuple(quantiles), 'minInventory': minInventory, \
+                'maxDebt': maxDebt, 'reducers': reducers}
+
+    #Python 3.8+, imported here so the rest of the module works without it
+    from multiprocessing import shared_memory
+
+    production = np.ascontiguousarray(production, dtype=np.float64)
+    shm = shared_memory.SharedMemory(create=True, size=max(production.nbytes, 1))
+    try:
+        np.ndarray(production.shape, dtype=production.dtype, buffer=shm.buf)[:] = production
+        pool = multiprocessing.Pool(numWorkers, _initScenarioWorker, \
+                                    (statements, shm.name, production.shape, production.dtype, settings))
+        try:
+            rows = [None]*len(scenarios)
+            for iScenario, row in pool.imap_unordered(_scenarioJob, list(enumerate(scenarios))):
+                rows[iScenario] = row
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return pd.concat([pd.DataFrame(scenarios), pd.DataFrame(rows)], axis=1)
             
 def plotTrialData(trialID, trials, t0):
     plt.figure(figsize=(8,5))
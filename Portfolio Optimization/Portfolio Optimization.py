@@ -7,143 +7,8 @@
 ################################################################################
 import matplotlib.pyplot as plt
 import pandas as pd
-import pandas.io.data as web
 import numpy as np
-import scipy.optimize as sco
-
-def getStockQuotes(symbols, source, startDate, endDate):
-    quotes = pd.DataFrame()
-    
-    for symbol in symbols:
-        quotes[symbol] = web.DataReader(symbol, data_source=source, start=startDate, end=endDate)['Adj Close']
-        
-    return quotes
-    
-def calcPortfolioPerf(weights, meanReturns, covMatrix):
-    '''
-    Calculates the expected mean of returns and volatility for a portolio of 
-    assets, each carrying the weight specified by weights
-    
-    INPUT
-    weights: array specifying the weight of each asset in the portfolio
-    meanReturns: mean values of each asset's returns
-    covMatrix: covariance of each asset in the portfolio
-    
-    OUTPUT
-    tuple containing the portfolio return and volatility
-    '''    
-    #Calculate return and variance
-    portReturn = np.sum( meanReturns*weights )
-    portStdDev = np.sqrt(np.dot(weights.T, np.dot(covMatrix, weights)))
-    
-    return portReturn, portStdDev
-    
-def negSharpeRatio(weights, meanReturns, covMatrix, riskFreeRate):
-    '''
-    Returns the negated Sharpe Ratio for the speicified portfolio of assets
-    
-    INPUT
-    weights: array specifying the weight of each asset in the portfolio
-    meanReturns: mean values of each asset's returns
-    covMatrix: covariance of each asset in the portfolio
-    riskFreeRate: time value of money
-    '''
-    p_ret, p_var = calcPortfolioPerf(weights, meanReturns, covMatrix)
-    
-    return -(p_ret - riskFreeRate) / p_var
-    
-def getPortfolioVol(weights, meanReturns, covMatrix):
-    '''
-    Returns the volatility of the specified portfolio of assets
-    
-    INPUT
-    weights: array specifying the weight of each asset in the portfolio
-    meanReturns: mean values of each asset's returns
-    covMatrix: covariance of each asset in the portfolio
-    
-    OUTPUT
-    The portfolio's volatility
-    '''
-    return calcPortfolioPerf(weights, meanReturns, covMatrix)[1]
-    
-def findMaxSharpeRatioPortfolio(meanReturns, covMatrix, riskFreeRate):
-    '''
-    Finds the portfolio of assets providing the maximum Sharpe Ratio
-    
-    INPUT
-    meanReturns: mean values of each asset's returns
-    covMatrix: covariance of each asset in the portfolio
-    riskFreeRate: time value of money
-    '''
-    numAssets = len(meanReturns)
-    args = (meanReturns, covMatrix, riskFreeRate)
-    constraints = ({'type': 'eq', 'fun': lambda x: np.sum(x) - 1})
-    bounds = tuple( (0,1) for asset in range(numAssets))
-    
-    opts = sco.minimize(negSharpeRatio, numAssets*[1./numAssets,], args=args, method='SLSQP', bounds=bounds, constraints=constraints)
-    
-    return opts
-    
-def findMinVariancePortfolio(meanReturns, covMatrix):
-    '''
-    Finds the portfolio of assets providing the lowest volatility
-    
-    INPUT
-    meanReturns: mean values of each asset's returns
-    covMatrix: covariance of each asset in the portfolio
-    '''
-    numAssets = len(meanReturns)
-    args = (meanReturns, covMatrix)
-    constraints = ({'type': 'eq', 'fun': lambda x: np.sum(x) - 1})
-    bounds = tuple( (0,1) for asset in range(numAssets))
-    
-    opts = sco.minimize(getPortfolioVol, numAssets*[1./numAssets,], args=args, method='SLSQP', bounds=bounds, constraints=constraints)
-    
-    return opts
-    
-def findEfficientReturn(meanReturns, covMatrix, targetReturn):
-    '''
-    Finds the portfolio of assets providing the target return with lowest
-    volatility
-    
-    INPUT
-    meanReturns: mean values of each asset's returns
-    covMatrix: covariance of each asset in the portfolio
-    targetReturn: APR of target expected return
-    
-    OUTPUT
-    Dictionary of results from optimization
-    '''
-    numAssets = len(meanReturns)
-    args = (meanReturns, covMatrix)
-    
-    def getPortfolioReturn(weights):
-        return calcPortfolioPerf(weights, meanReturns, covMatrix)[0]
-    
-    constraints = ({'type': 'eq', 'fun': lambda x: getPortfolioReturn(x) - targetReturn},
-                   {'type': 'eq', 'fun': lambda x: np.sum(x) - 1})
-    bounds = tuple((0,1) for asset in range(numAssets))
-    
-    return sco.minimize(getPortfolioVol, numAssets*[1./numAssets,], args=args, method='SLSQP', bounds=bounds, constraints=constraints)
-    
-def findEfficientFrontier(meanReturns, covMatrix, rangeOfReturns):
-    '''
-    Finds the set of portfolios comprising the efficient frontier
-    
-    INPUT
-    meanReturns: mean values of each asset's returns
-    covMatrix: covariance of each asset in the portfolio
-    targetReturn: APR of target expected return
-    
-    OUTPUT
-    Dictionary of results from optimization
-    '''
-    efficientPortfolios = []
-    for ret in rangeOfReturns:
-        efficientPortfolios.append(findEfficientReturn(meanReturns, covMatrix, ret))
-        
-    return efficientPortfolios
-    
+from portfolioTools import *
 
 availStocks = ['GOOGL', 'AAPL', 'AMZN', 'MSFT', 'F', 'BMW.DE', 'TM', 'KO', 'PEP']
 stocks = availStocks
@@ -176,21 +41,7 @@ plt.figure(figsize=(8,6))
 
 #Run MC simulation of numPortfolios portfolios
 numPortfolios = 100000
-results = np.zeros((3,numPortfolios))
-
-#Calculate portfolios
-for i in range(numPortfolios):
-    #Draw numAssets random numbers and normalize them to be the portfolio weights
-    weights = np.random.random(numAssets)
-    weights /= np.sum(weights)
-    
-    #Calculate expected return and volatility of portfolio
-    pret, pvar = calcPortfolioPerf(weights, meanDailyReturn, covariance)
-    
-    #Convert results to annual basis, calculate Sharpe Ratio, and store them
-    results[0,i] = pret*numPeriodsAnnually
-    results[1,i] = pvar*np.sqrt(numPeriodsAnnually)
-    results[2,i] = (results[0,i] - riskFreeRate)/results[1,i]
+results = randomPortfolios(meanDailyReturn, covariance, numPortfolios, riskFreeRate, numPeriodsAnnually)
     
 #Plot results of MC on portfolio weights
 plt.scatter(results[1,:], results[0,:], c=results[2,:], marker='o')
@@ -198,7 +49,7 @@ plt.scatter(results[1,:], results[0,:], c=results[2,:], marker='o')
 #Find efficient frontier, annual target returns of 9% and 16% are converted to
 #match period of mean returns calculated previously
 targetReturns = np.linspace(0.09, 0.26, 50)/(252./dur)
-efficientPortfolios = findEfficientFrontier(meanDailyReturn, covariance, targetReturns)
+efficientPortfolios = findEfficientFrontier(meanDailyReturn, covariance, targetReturns, method='cla')
 plt.plot([p['fun']*np.sqrt(numPeriodsAnnually) for p in efficientPortfolios], targetReturns*numPeriodsAnnually, marker='x')
 
 #Find portfolio with maximum Sharpe ratio
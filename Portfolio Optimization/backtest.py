@@ -0,0 +1,208 @@
+################################################################################
+
+#Walk-forward backtests of the portfolio optimizers
+
+#At every rebalance date the mean returns and covariance are re-estimated over
+#a rolling window, the strategy's optimizer picks new weights and the
+#portfolio is held, drifting with prices, over the following periods. The
+#weights at different rebalance dates only depend on their own estimates, so
+#every (configuration, block of rebalance dates) pair is an independent job
+#for a process pool. Realized performance is put together afterwards.
+
+################################################################################
+
+import multiprocessing
+import time
+import numpy as np
+import pandas as pd
+from portfolioTools import *
+from rollingEstimates import rollingEstimates
+
+numPeriodsAnnually = 252.0
+
+defaultConfig = {'strategy': 'maxSharpe', 'window': 250, 'rebalance': 20, 'riskFreeRate': 0.0, \
+                 'targetReturn': None, 'tickers': None, 'numFactors': None}
+
+def equalWeights(meanReturns, covMatrix, config, x0=None):
+    return np.full(len(meanReturns), 1.0/len(meanReturns))
+
+def maxSharpeWeights(meanReturns, covMatrix, config, x0=None):
+    return findMaxSharpeRatioPortfolio(meanReturns, covMatrix, config['riskFreeRate'], x0)['x']
+
+def minVarianceWeights(meanReturns, covMatrix, config, x0=None):
+    return findMinVariancePortfolio(meanReturns, covMatrix, x0)['x']
+
+def targetReturnWeights(meanReturns, covMatrix, config, x0=None):
+    #Targets outside the reachable returns are moved to the nearest one
+    minVar = findMinVariancePortfolio(meanReturns, covMatrix, x0)['x']
+    target = np.clip(config['targetReturn'], np.dot(minVar, meanReturns), np.max(meanReturns))
+    opts = findEfficientReturn(meanReturns, covMatrix, target, minVar)
+    return opts['x'] if opts['success'] else minVar
+
+strategies = {'equalWeight': equalWeights, 'maxSharpe': maxSharpeWeights, \
+              'minVariance': minVarianceWeights, 'targetReturn': targetReturnWeights}
+
+def makeConfig(**kwargs):
+    '''
+    Returns a backtest configuration, see defaultConfig for the keys. window
+    and rebalance are in periods, riskFreeRate and targetReturn are per period.
+    numFactors replaces the covariance with a k-factor model when given.
+    '''
+    config = dict(defaultConfig)
+    for key in kwargs:
+        if key not in config:
+            raise KeyError('Unknown backtest setting %s' % key)
+        config[key] = kwargs[key]
+    if config['strategy'] not in strategies:
+        raise ValueError('Unknown strategy %s' % config['strategy'])
+    return config
+
+#Summary column of each configuration setting
+configColumns = {'strategy': 'Strategy', 'window': 'Window', 'rebalance': 'Rebalance', \
+                 'riskFreeRate': 'Risk Free Rate', 'targetReturn': 'Target Return', 'tickers': 'Tickers', \
+                 'numFactors': 'Factors'}
+
+def configSummary(config):
+    #Every setting of the configuration, labelled for the summary
+    row = {}
+    keys = ['strategy', 'window', 'rebalance', 'riskFreeRate', 'targetReturn', 'tickers', 'numFactors']
+    for key in keys + sorted(set(defaultConfig) - set(keys)):
+        value = config[key]
+        if key == 'tickers':
+            value = 'All' if value is None else ','.join(value)
+        row[configColumns.get(key, key)] = value
+    return row
+
+def configReturns(rets, config):
+    return rets if config['tickers'] is None else rets[list(config['tickers'])]
+
+def rebalanceRows(numPeriods, config):
+    #Rows of the rebalance dates, the last one must have a period to hold over
+    return np.arange(config['window'] - 1, numPeriods - 1, config['rebalance'])
+
+def rebalanceWeights(rets, config, rows):
+    '''
+    Optimal weights at each of the rebalance rows, one row of an array over
+    all of the columns of rets per date, zero for assets left out
+    '''
+    window = config['window']
+    strategy = strategies[config['strategy']]
+    weights = np.zeros((len(rows), rets.shape[1]))
+    columns = pd.Index(rets.columns)
+
+    #Estimates from the first row onwards, every rebalance periods
+    start = rows[0] - window + 1
+    stop = rows[-1] + 1
+    estimates = rollingEstimates(rets.iloc[start:stop], window, step=config['rebalance'])
+
+    previous = None
+    for k, (date, meanReturns, covMatrix) in enumerate(estimates):
+        x0 = None
+        if previous is not None:
+            #Warm start from the last weights of the assets still available
+            x0 = previous.reindex(meanReturns.index).fillna(0).values
+            x0 = x0/x0.sum() if x0.sum() > 0 else None
+        cov = covMatrix.values
+        if config['numFactors']:
+            cov = FactorCovariance.fromDense(cov, config['numFactors'])
+        w = strategy(meanReturns.values, cov, config, x0)
+        previous = pd.Series(w, index=meanReturns.index)
+        weights[k, columns.get_indexer(meanReturns.index)] = w
+
+    return weights
+
+def portfolioPerformance(rets, rows, weights):
+    '''
+    Holds the weights from each rebalance row to the next, letting them drift
+    with the assets' returns
+
+    OUTPUT
+    tuple (periodReturns, turnover), the portfolio's simple return in every
+    period after the first rebalance and the traded weight at each rebalance
+    '''
+    growth = np.expm1(rets.values)
+    growth[np.isnan(growth)] = 0.0
+    ends = np.append(rows[1:], len(growth) - 1)
+
+    periodReturns = []
+    turnover = np.empty(len(rows))
+    drifted = np.zeros(rets.shape[1])
+    for k in range(len(rows)):
+        turnover[k] = np.abs(weights[k] - drifted).sum()
+        value = np.dot(np.cumprod(1 + growth[rows[k] + 1:ends[k] + 1], axis=0), weights[k])
+        periodReturns.append(np.diff(np.concatenate(([1.0], value)))/np.concatenate(([1.0], value[:-1])))
+        held = weights[k]*np.prod(1 + growth[rows[k] + 1:ends[k] + 1], axis=0)
+        drifted = held/held.sum()
+
+    return pd.Series(np.concatenate(periodReturns), index=rets.index[rows[0] + 1:ends[-1] + 1]), turnover
+
+################################################################################
+
+#Process pool
+
+################################################################################
+
+_workerData = {}
+
+def _initWorker(rets):
+    _workerData['rets'] = rets
+
+def _backtestJob(job):
+    iConfig, config, rows = job
+    start = time.time()
+    weights = rebalanceWeights(configReturns(_workerData['rets'], config), config, rows)
+    return iConfig, rows, weights, time.time() - start
+
+def runBacktests(rets, configs, numWorkers=None, datesPerJob=10):
+    '''
+    Runs a walk-forward backtest for each configuration
+
+    INPUT
+    rets: DataFrame of log returns indexed by date, NaN where an asset did not
+          trade, e.g. from np.log(PriceStore().getStockQuotes(...)).diff()
+    configs: list of configurations from makeConfig
+    numWorkers: processes in the pool, defaults to the number of CPUs
+    datesPerJob: rebalance dates optimized by each job
+
+    OUTPUT
+    tuple (summary, periodReturns), summary has one row per configuration,
+    indexed like configs, with all of its settings, the annual return,
+    volatility and Sharpe Ratio, the mean turnover per rebalance and the
+    optimization time summed over the jobs; periodReturns has the portfolio
+    return of each configuration in every period, in the same order
+    '''
+    jobs = []
+    for iConfig, config in enumerate(configs):
+        rows = rebalanceRows(len(rets), config)
+        for start in range(0, len(rows), datesPerJob):
+            jobs.append((iConfig, config, rows[start:start + datesPerJob]))
+
+    results = [[] for config in configs]
+    pool = multiprocessing.Pool(numWorkers, _initWorker, (rets,))
+    try:
+        for iConfig, rows, weights, elapsed in pool.imap_unordered(_backtestJob, jobs):
+            results[iConfig].append((rows, weights, elapsed))
+    finally:
+        pool.close()
+        pool.join()
+
+    summary = []
+    periodReturns = {}
+    for iConfig, config in enumerate(configs):
+        parts = sorted(results[iConfig], key=lambda r: r[0][0])
+        rows = np.concatenate([r[0] for r in parts])
+        weights = np.concatenate([r[1] for r in parts])
+        configRets = configReturns(rets, config)
+
+        returns, turnover = portfolioPerformance(configRets, rows, weights)
+        annualReturn = returns.mean()*numPeriodsAnnually
+        annualVol = returns.std()*np.sqrt(numPeriodsAnnually)
+        row = configSummary(config)
+        row.update({'Annual Return': annualReturn, 'Annual Volatility': annualVol, \
+                    'Sharpe Ratio': (annualReturn - config['riskFreeRate']*numPeriodsAnnually)/annualVol, \
+                    'Turnover': turnover[1:].mean() if len(turnover) > 1 else np.nan, \
+                    'Wall Time': sum(r[2] for r in parts)})
+        summary.append(row)
+        periodReturns[iConfig] = returns
+
+    return pd.DataFrame(summary, columns=list(summary[0])), pd.DataFrame(periodReturns)
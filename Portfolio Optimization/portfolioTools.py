@@ -0,0 +1,509 @@
+################################################################################
+
+#Tools for analyzing portfolios
+
+#Bradford Lynch, 2015, Ann Arbor, MI
+
+################################################################################
+import pandas as pd
+import numpy as np
+import scipy.optimize as sco
+
+try:
+    import pandas.io.data as web
+except ImportError:
+    #pandas.io.data was split out into the pandas_datareader package
+    try:
+        import pandas_datareader.data as web
+    except ImportError:
+        web = None
+
+def getStockQuotes(symbols, source, startDate, endDate):
+    if source == 'quantquote':
+        #Bundled S&P 500 data, read offline from the memory-mapped store
+        from priceStore import PriceStore, buildPriceStore
+        buildPriceStore()
+        return PriceStore().getStockQuotes(symbols, startDate, endDate)
+
+    quotes = pd.DataFrame()
+    
+    for symbol in symbols:
+        quotes[symbol] = web.DataReader(symbol, data_source=source, start=startDate, end=endDate)['Adj Close']
+        
+    return quotes
+    
+class FactorCovariance(object):
+    '''
+    Covariance of a k-factor model, loadings*loadings.T + diag(specific),
+    stored in O(N*k) memory. The portfolio functions accept it in place of a
+    dense covariance matrix.
+    
+    INPUT
+    loadings: array of shape (numAssets, numFactors)
+    specific: specific (idiosyncratic) variance of each asset
+    '''
+    def __init__(self, loadings, specific):
+        self.loadings = np.asarray(loadings, dtype=float)
+        self.specific = np.asarray(specific, dtype=float)
+        self.shape = (len(self.specific), len(self.specific))
+        
+    @classmethod
+    def fromDense(cls, covMatrix, numFactors):
+        #Principal components of a dense covariance, the diagonal is kept exact
+        covMatrix = np.asarray(covMatrix, dtype=float)
+        eigVals, eigVecs = np.linalg.eigh(covMatrix)
+        top = np.argsort(eigVals)[::-1][:numFactors]
+        loadings = eigVecs[:,top]*np.sqrt(np.maximum(eigVals[top], 0))
+        specific = np.maximum(np.diag(covMatrix) - np.square(loadings).sum(axis=1), 0)
+        return cls(loadings, specific)
+        
+    def dot(self, weights):
+        #Covariance times a weight vector, or weight vectors in the columns
+        weights = np.asarray(weights, dtype=float)
+        specific = self.specific if weights.ndim == 1 else self.specific[:,None]
+        return np.dot(self.loadings, np.dot(self.loadings.T, weights)) + specific*weights
+        
+    def toDense(self):
+        return np.dot(self.loadings, self.loadings.T) + np.diag(self.specific)
+        
+def estimateFactorCovariance(rets, numFactors):
+    '''
+    Fits a statistical k-factor model to a matrix of returns from its
+    principal components without forming the dense covariance
+    
+    INPUT
+    rets: returns with one period per row and one asset per column, missing
+          returns are taken as the asset's mean
+    numFactors: number of factors
+    
+    OUTPUT
+    FactorCovariance matching the sample variance of each asset
+    '''
+    rets = np.asarray(rets, dtype=float)
+    present = ~np.isnan(rets)
+    centred = np.where(present, rets - np.nanmean(rets, axis=0), 0.0)
+    numPeriods = present.sum(axis=0)
+    
+    #Leading right singular vectors of the centred returns
+    u, sv, vt = np.linalg.svd(centred, full_matrices=False)
+    loadings = vt[:numFactors].T*sv[:numFactors]/np.sqrt(len(rets) - 1)
+    variance = np.square(centred).sum(axis=0)/(numPeriods - 1)
+    specific = np.maximum(variance - np.square(loadings).sum(axis=1), 0)
+    
+    return FactorCovariance(loadings, specific)
+    
+def covDot(covMatrix, weights):
+    #Covariance times weights for either the dense or the factor form
+    if isinstance(covMatrix, FactorCovariance):
+        return covMatrix.dot(weights)
+    return np.dot(covMatrix, weights)
+    
+def asCovariance(covMatrix):
+    return covMatrix if isinstance(covMatrix, FactorCovariance) else np.asarray(covMatrix, dtype=float)
+    
+def calcPortfolioPerf(weights, meanReturns, covMatrix):
+    '''
+    Calculates the expected mean of returns and volatility for a portolio of 
+    assets, each carrying the weight specified by weights
+    
+    INPUT
+    weights: array specifying the weight of each asset in the portfolio
+    meanReturns: mean values of each asset's returns
+    covMatrix: covariance of each asset in the portfolio
+    
+    OUTPUT
+    tuple containing the portfolio return and volatility
+    '''    
+    #Calculate return and variance
+    portReturn = np.sum( meanReturns*weights )
+    portStdDev = np.sqrt(np.dot(weights.T, covDot(covMatrix, weights)))
+    
+    return portReturn, portStdDev
+    
+def randomPortfolios(meanReturns, covMatrix, numPortfolios, riskFreeRate, numPeriodsAnnually, chunkSize=10000, randomState=np.random):
+    '''
+    Draws random long-only portfolios and calculates their performance a
+    block of chunkSize portfolios at a time with matrix operations
+    
+    INPUT
+    meanReturns: mean values of each asset's returns
+    covMatrix: covariance of each asset in the portfolio
+    numPortfolios: number of random portfolios to draw
+    riskFreeRate: time value of money
+    numPeriodsAnnually: number of return periods per year
+    chunkSize: number of portfolios evaluated at once, bounds the memory used
+    
+    OUTPUT
+    array of shape (3, numPortfolios) holding the annual return, volatility
+    and Sharpe Ratio of each portfolio
+    '''
+    meanReturns = np.asarray(meanReturns, dtype=float)
+    covMatrix = asCovariance(covMatrix)
+    numAssets = len(meanReturns)
+    results = np.empty((3, numPortfolios))
+    
+    #A sample covariance estimated from fewer periods than assets is low rank,
+    #writing it as B*B.T lets the variance be computed as |w*B|^2 in O(N*k)
+    factor = None
+    specific = None
+    if isinstance(covMatrix, FactorCovariance):
+        factor = covMatrix.loadings
+        specific = covMatrix.specific
+    else:
+        eigVals, eigVecs = np.linalg.eigh(covMatrix)
+        keep = eigVals > 1E-12*eigVals.max()
+        if (keep.sum() < numAssets/2) and (eigVals.min() > -1E-12*eigVals.max()):
+            factor = eigVecs[:,keep]*np.sqrt(eigVals[keep])
+    
+    for start in range(0, numPortfolios, chunkSize):
+        stop = min(start + chunkSize, numPortfolios)
+        weights = randomState.random_sample((stop - start, numAssets))
+        weights /= weights.sum(axis=1)[:,None]
+        
+        portReturn = np.dot(weights, meanReturns)
+        if factor is None:
+            portStdDev = np.sqrt(np.einsum('ij,ij->i', np.dot(weights, covMatrix), weights))
+        else:
+            portVar = np.square(np.dot(weights, factor)).sum(axis=1)
+            if specific is not None:
+                portVar += np.dot(np.square(weights), specific)
+            portStdDev = np.sqrt(portVar)
+        
+        results[0,start:stop] = portReturn*numPeriodsAnnually
+        results[1,start:stop] = portStdDev*np.sqrt(numPeriodsAnnually)
+        results[2,start:stop] = (results[0,start:stop] - riskFreeRate)/results[1,start:stop]
+        
+    return results
+    
+def negSharpeRatio(weights, meanReturns, covMatrix, riskFreeRate):
+    '''
+    Returns the negated Sharpe Ratio for the speicified portfolio of assets
+    
+    INPUT
+    weights: array specifying the weight of each asset in the portfolio
+    meanReturns: mean values of each asset's returns
+    covMatrix: covariance of each asset in the portfolio
+    riskFreeRate: time value of money
+    '''
+    p_ret, p_var = calcPortfolioPerf(weights, meanReturns, covMatrix)
+    
+    return -(p_ret - riskFreeRate) / p_var
+    
+def getPortfolioVol(weights, meanReturns, covMatrix):
+    '''
+    Returns the volatility of the specified portfolio of assets
+    
+    INPUT
+    weights: array specifying the weight of each asset in the portfolio
+    meanReturns: mean values of each asset's returns
+    covMatrix: covariance of each asset in the portfolio
+    
+    OUTPUT
+    The portfolio's volatility
+    '''
+    return calcPortfolioPerf(weights, meanReturns, covMatrix)[1]
+    
+def getPortfolioVolGrad(weights, meanReturns, covMatrix):
+    '''
+    Returns the volatility of the specified portfolio of assets and its
+    gradient with respect to the weights
+    
+    INPUT
+    weights: array specifying the weight of each asset in the portfolio
+    meanReturns: mean values of each asset's returns
+    covMatrix: covariance of each asset in the portfolio
+    
+    OUTPUT
+    tuple containing the portfolio volatility and its gradient
+    '''
+    covWeights = covDot(covMatrix, weights)
+    portStdDev = np.sqrt(np.dot(weights, covWeights))
+    
+    return portStdDev, covWeights/portStdDev
+    
+def negSharpeRatioGrad(weights, meanReturns, covMatrix, riskFreeRate):
+    '''
+    Returns the negated Sharpe Ratio for the specified portfolio of assets and
+    its gradient with respect to the weights
+    
+    INPUT
+    weights: array specifying the weight of each asset in the portfolio
+    meanReturns: mean values of each asset's returns
+    covMatrix: covariance of each asset in the portfolio
+    riskFreeRate: time value of money
+    
+    OUTPUT
+    tuple containing the negated Sharpe Ratio and its gradient
+    '''
+    covWeights = covDot(covMatrix, weights)
+    portStdDev = np.sqrt(np.dot(weights, covWeights))
+    excessReturn = np.dot(meanReturns, weights) - riskFreeRate
+    
+    grad = -(meanReturns - excessReturn*covWeights/portStdDev**2)/portStdDev
+    
+    return -excessReturn/portStdDev, grad
+    
+def portfolioConstraints(numAssets, meanReturns=None, targetReturn=None):
+    #Fully invested and, when targetReturn is given, on target, with Jacobians
+    constraints = [{'type': 'eq', 'fun': lambda x: np.sum(x) - 1, 'jac': lambda x: np.ones(numAssets)}]
+    if targetReturn is not None:
+        constraints.append({'type': 'eq', 'fun': lambda x: np.dot(meanReturns, x) - targetReturn, \
+                            'jac': lambda x: meanReturns})
+        
+    return constraints
+    
+def findMaxSharpeRatioPortfolio(meanReturns, covMatrix, riskFreeRate, x0=None):
+    '''
+    Finds the portfolio of assets providing the maximum Sharpe Ratio
+    
+    INPUT
+    meanReturns: mean values of each asset's returns
+    covMatrix: covariance of each asset in the portfolio
+    riskFreeRate: time value of money
+    x0: starting weights, defaults to equal weights
+    '''
+    meanReturns = np.asarray(meanReturns, dtype=float)
+    covMatrix = asCovariance(covMatrix)
+    numAssets = len(meanReturns)
+    if x0 is None:
+        x0 = np.full(numAssets, 1./numAssets)
+    args = (meanReturns, covMatrix, riskFreeRate)
+    bounds = tuple( (0,1) for asset in range(numAssets))
+    
+    opts = sco.minimize(negSharpeRatioGrad, x0, args=args, jac=True, method='SLSQP', bounds=bounds, \
+                        constraints=portfolioConstraints(numAssets))
+    
+    return opts
+    
+def findMinVariancePortfolio(meanReturns, covMatrix, x0=None):
+    '''
+    Finds the portfolio of assets providing the lowest volatility
+    
+    INPUT
+    meanReturns: mean values of each asset's returns
+    covMatrix: covariance of each asset in the portfolio
+    x0: starting weights, defaults to equal weights
+    '''
+    meanReturns = np.asarray(meanReturns, dtype=float)
+    covMatrix = asCovariance(covMatrix)
+    numAssets = len(meanReturns)
+    if x0 is None:
+        x0 = np.full(numAssets, 1./numAssets)
+    args = (meanReturns, covMatrix)
+    bounds = tuple( (0,1) for asset in range(numAssets))
+    
+    opts = sco.minimize(getPortfolioVolGrad, x0, args=args, jac=True, method='SLSQP', bounds=bounds, \
+                        constraints=portfolioConstraints(numAssets))
+    
+    return opts
+    
+def findEfficientReturn(meanReturns, covMatrix, targetReturn, x0=None):
+    '''
+    Finds the portfolio of assets providing the target return with lowest
+    volatility
+    
+    INPUT
+    meanReturns: mean values of each asset's returns
+    covMatrix: covariance of each asset in the portfolio
+    targetReturn: APR of target expected return
+    x0: starting weights, defaults to equal weights
+    
+    OUTPUT
+    Dictionary of results from optimization
+    '''
+    meanReturns = np.asarray(meanReturns, dtype=float)
+    covMatrix = asCovariance(covMatrix)
+    numAssets = len(meanReturns)
+    if x0 is None:
+        x0 = np.full(numAssets, 1./numAssets)
+    args = (meanReturns, covMatrix)
+    bounds = tuple((0,1) for asset in range(numAssets))
+    
+    return sco.minimize(getPortfolioVolGrad, x0, args=args, jac=True, method='SLSQP', bounds=bounds, \
+                        constraints=portfolioConstraints(numAssets, meanReturns, targetReturn))
+    
+################################################################################
+
+#Critical line algorithm
+
+#Solves min 0.5*w'Cw - lambda*m'w subject to sum(w) = 1 and lower <= w <= upper
+#for every lambda at once. Between turning points the set of assets away from
+#their bounds is fixed and the weights are linear in lambda, so the long-only
+#frontier is the piecewise linear path through the turning points.
+
+################################################################################
+
+def freeWeights(covMatrix, meanReturns, weights, free):
+    '''
+    Returns (alpha, beta, gamma0, gamma1) such that the free weights are
+    alpha + lambda*beta and the budget multiplier is gamma0 + lambda*gamma1
+    while the bounded weights stay fixed
+    '''
+    bound = np.ones(len(meanReturns), dtype=bool)
+    bound[free] = False
+    
+    covF = covMatrix[np.ix_(free, free)]
+    rhs = np.column_stack((np.ones(len(free)), meanReturns[free], np.dot(covMatrix[np.ix_(free, bound)], weights[bound])))
+    aOnes, aMean, aBound = np.linalg.solve(covF, rhs).T
+    
+    gamma0 = (1 - weights[bound].sum() + aBound.sum())/aOnes.sum()
+    gamma1 = -aMean.sum()/aOnes.sum()
+    
+    return gamma0*aOnes - aBound, aMean + gamma1*aOnes, gamma0, gamma1
+    
+def criticalLineTurningPoints(meanReturns, covMatrix, lower=None, upper=None, tol=1E-12):
+    '''
+    Finds the turning points of the efficient frontier with the critical line
+    algorithm. covMatrix must be positive definite, a FactorCovariance is
+    expanded to its dense form.
+    
+    INPUT
+    meanReturns: mean values of each asset's returns
+    covMatrix: covariance of each asset in the portfolio
+    lower: lower bound on each weight, defaults to 0
+    upper: upper bound on each weight, defaults to 1
+    
+    OUTPUT
+    tuple (weights, lambdas), weights has one turning point portfolio per row
+    ordered from the highest return to the minimum variance portfolio
+    '''
+    meanReturns = np.asarray(meanReturns, dtype=float)
+    covMatrix = asCovariance(covMatrix)
+    if isinstance(covMatrix, FactorCovariance):
+        covMatrix = covMatrix.toDense()
+    numAssets = len(meanReturns)
+    lower = np.zeros(numAssets) if lower is None else np.asarray(lower, dtype=float)
+    upper = np.ones(numAssets) if upper is None else np.asarray(upper, dtype=float)
+    
+    #Start from the highest return portfolio, filling assets to their upper
+    #bound in order of decreasing return
+    weights = lower.copy()
+    for i in np.argsort(-meanReturns, kind='mergesort'):
+        weights[i] = min(upper[i], 1 - weights.sum() + lower[i])
+        if weights.sum() >= 1 - tol:
+            free = [i]
+            break
+    else:
+        raise ValueError('The bounds do not allow a fully invested portfolio')
+        
+    turningPoints = [weights.copy()]
+    lambdas = [np.inf]
+    
+    for iteration in range(10*numAssets + 10):
+        lam = lambdas[-1]
+        alpha, beta, gamma0, gamma1 = freeWeights(covMatrix, meanReturns, weights, free)
+        freeIdx = np.array(free)
+        
+        #Free asset reaching a bound as lambda decreases
+        events = []
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bi = np.where(beta > 0, lower[freeIdx], upper[freeIdx])
+            lamOut = (bi - alpha)/beta
+        lamOut[(np.abs(beta) <= tol) | ~(lamOut < lam)] = -np.inf
+        if len(free) > 1 and len(lamOut):
+            k = np.argmax(lamOut)
+            events.append((lamOut[k], 'out', freeIdx[k], bi[k]))
+            
+        #Bounded asset whose reduced gradient crosses zero as lambda decreases
+        boundIdx = np.setdiff1d(np.arange(numAssets), freeIdx)
+        if len(boundIdx):
+            p = np.dot(covMatrix[np.ix_(boundIdx, freeIdx)], alpha) + \
+                np.dot(covMatrix[np.ix_(boundIdx, boundIdx)], weights[boundIdx]) - gamma0
+            q = np.dot(covMatrix[np.ix_(boundIdx, freeIdx)], beta) - meanReturns[boundIdx] - gamma1
+            with np.errstate(divide='ignore', invalid='ignore'):
+                lamIn = -p/q
+            atLower = weights[boundIdx] <= lower[boundIdx] + tol
+            #Leaving the lower bound needs the gradient to turn negative
+            entering = np.where(atLower, q > tol, q < -tol)
+            lamIn[~entering | ~(lamIn < lam)] = -np.inf
+            k = np.argmax(lamIn)
+            events.append((lamIn[k], 'in', boundIdx[k], None))
+            
+        nextLam, action, asset, bi = max(events, key=lambda e: e[0]) if events else (-np.inf, None, None, None)
+        if nextLam <= 0:
+            #Minimum variance portfolio closes the frontier
+            weights[freeIdx] = alpha
+            turningPoints.append(weights.copy())
+            lambdas.append(0.0)
+            break
+            
+        weights[freeIdx] = alpha + nextLam*beta
+        if action == 'out':
+            weights[asset] = bi
+            free.remove(asset)
+        else:
+            free.append(asset)
+        turningPoints.append(weights.copy())
+        lambdas.append(nextLam)
+        
+    return np.array(turningPoints), np.array(lambdas)
+    
+def criticalLinePortfolios(meanReturns, covMatrix, rangeOfReturns, turningPoints=None):
+    '''
+    Interpolates the efficient portfolio for each target return between the
+    turning points of the critical line algorithm
+
+    OUTPUT
+    array with the weights of one portfolio per row, NaN for targets outside
+    the span of the efficient frontier
+    '''
+    meanReturns = np.asarray(meanReturns, dtype=float)
+    if turningPoints is None:
+        turningPoints = criticalLineTurningPoints(meanReturns, covMatrix)[0]
+        
+    #Returns fall along the turning points, reverse them for the search
+    pointReturns = np.dot(turningPoints, meanReturns)[::-1]
+    points = turningPoints[::-1]
+    targets = np.asarray(rangeOfReturns, dtype=float)
+    
+    j = np.clip(np.searchsorted(pointReturns, targets) - 1, 0, len(points) - 2)
+    span = pointReturns[j + 1] - pointReturns[j]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(span > 0, (targets - pointReturns[j])/span, 0.0)
+    weights = points[j] + t[:,None]*(points[j + 1] - points[j])
+    
+    outside = (targets < pointReturns[0]) | (targets > pointReturns[-1])
+    weights[outside] = np.nan
+    
+    return weights
+    
+def findEfficientFrontier(meanReturns, covMatrix, rangeOfReturns, method='slsqp'):
+    '''
+    Finds the set of portfolios comprising the efficient frontier
+    
+    INPUT
+    meanReturns: mean values of each asset's returns
+    covMatrix: covariance of each asset in the portfolio
+    rangeOfReturns: target expected returns
+    method: 'slsqp' solves the target returns in increasing order, each one
+            starting from the previous solution. 'cla' builds the whole
+            frontier with the critical line algorithm, targets below the
+            minimum variance portfolio's return fall back to 'slsqp'.
+    
+    OUTPUT
+    Dictionary of results from optimization
+    '''
+    meanReturns = np.asarray(meanReturns, dtype=float)
+    covMatrix = asCovariance(covMatrix)
+    rangeOfReturns = np.asarray(rangeOfReturns, dtype=float)
+    
+    efficientPortfolios = [None]*len(rangeOfReturns)
+    if method == 'cla':
+        claWeights = criticalLinePortfolios(meanReturns, covMatrix, rangeOfReturns)
+        for i, weights in enumerate(claWeights):
+            if not np.isnan(weights[0]):
+                efficientPortfolios[i] = sco.OptimizeResult(x=weights, success=True, status=0, \
+                        fun=getPortfolioVolGrad(weights, meanReturns, covMatrix)[0], message='Critical line')
+    elif method != 'slsqp':
+        raise ValueError("method must be 'slsqp' or 'cla'")
+        
+    x0 = None
+    for i in np.argsort(rangeOfReturns, kind='mergesort'):
+        if efficientPortfolios[i] is None:
+            efficientPortfolios[i] = findEfficientReturn(meanReturns, covMatrix, rangeOfReturns[i], x0)
+            if efficientPortfolios[i]['success']:
+                x0 = efficientPortfolios[i]['x']
+        else:
+            x0 = efficientPortfolios[i]['x']
+        
+    return efficientPortfolios
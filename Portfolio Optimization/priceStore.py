@@ -0,0 +1,208 @@
+################################################################################
+
+#Columnar price store for the bundled quantquote daily S&P 500 data
+
+#The daily/table_<ticker>.csv files (date, time, open, high, low, close,
+#volume, no header) are parsed once and written as one aligned date x ticker
+#matrix per field in .npy files. Later loads memory-map the matrices, so a
+#request only touches the rows and columns it slices out. A manifest of the
+#CSV sizes and modification times lets buildPriceStore re-parse only the files
+#that changed.
+
+################################################################################
+
+import glob
+import json
+import multiprocessing as mp
+import os
+import numpy as np
+import pandas as pd
+
+fields = ['open', 'high', 'low', 'close', 'volume']
+defaultCSVDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'quantquote_daily_sp500_83986', 'daily')
+defaultStoreDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'quantquoteStore')
+
+def parseQuantQuote(path):
+    '''
+    Parses a single quantquote CSV
+
+    OUTPUT
+    tuple (dates, values), dates as yyyymmdd integers and values of shape
+    (numDates, len(fields))
+    '''
+    table = pd.read_csv(path, header=None, usecols=[0, 2, 3, 4, 5, 6])
+    return table[0].values.astype(np.int64), table[[2, 3, 4, 5, 6]].values.astype(np.float64)
+
+def csvTickers(csvDir):
+    #Maps each ticker to its CSV path
+    paths = glob.glob(os.path.join(csvDir, 'table_*.csv'))
+    return dict((os.path.basename(p)[len('table_'):-len('.csv')].upper(), p) for p in sorted(paths))
+
+def fileSignature(path):
+    info = os.stat(path)
+    return [info.st_size, info.st_mtime_ns]
+
+def readManifest(storeDir):
+    try:
+        with open(os.path.join(storeDir, 'manifest.json')) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def fieldPath(storeDir, field):
+    return os.path.join(storeDir, field + '.npy')
+
+def buildPriceStore(csvDir=defaultCSVDir, storeDir=defaultStoreDir, numWorkers=None, rebuild=False):
+    '''
+    Builds or incrementally updates the price store
+
+    INPUT
+    csvDir: directory holding the quantquote table_*.csv files
+    storeDir: directory the store is written to
+    numWorkers: processes parsing CSVs, defaults to the number of CPUs
+    rebuild: re-parse every CSV even when the store is up to date
+
+    OUTPUT
+    list of the tickers whose CSVs were parsed
+    '''
+    paths = csvTickers(csvDir)
+    signatures = dict((ticker, fileSignature(p)) for ticker, p in paths.items())
+    manifest = None if rebuild else readManifest(storeDir)
+    if manifest is not None and not all(os.path.exists(fieldPath(storeDir, f)) for f in fields):
+        manifest = None
+    #A store built from other CSVs or fields is rebuilt rather than merged into
+    if manifest is not None and (manifest.get('csvDir') != os.path.abspath(csvDir) or manifest.get('fields') != fields):
+        manifest = None
+
+    old = {} if manifest is None else manifest['files']
+    changed = [t for t in sorted(paths) if old.get(t) != signatures[t]]
+    if manifest is not None and not changed and sorted(old) == sorted(paths):
+        return []
+
+    if changed:
+        pool = mp.Pool(numWorkers)
+        try:
+            parsed = dict(zip(changed, pool.map(parseQuantQuote, [paths[t] for t in changed])))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        parsed = {}
+
+    if manifest is not None:
+        oldStore = PriceStore(storeDir)
+        oldColumn = dict((t, i) for i, t in enumerate(oldStore.tickers))
+        kept = [t for t in sorted(paths) if t not in parsed]
+    else:
+        kept = []
+
+    #Union of the trading dates, unchanged tickers keep the dates they had
+    dateSets = [d for d, v in parsed.values()]
+    if kept:
+        keptColumns = [oldColumn[t] for t in kept]
+        listed = ~np.isnan(oldStore.matrix('close')[:, keptColumns]).all(axis=1)
+        dateSets.append(oldStore.dateKeys[listed])
+    dates = np.unique(np.concatenate(dateSets)) if dateSets else np.empty(0, dtype=np.int64)
+    tickers = sorted(paths)
+
+    os.makedirs(storeDir, exist_ok=True)
+    sameLayout = manifest is not None and tickers == oldStore.tickers and np.array_equal(dates, oldStore.dateKeys)
+
+    for k, field in enumerate(fields):
+        if sameLayout:
+            #Only the changed columns are rewritten, in place
+            matrix = np.load(fieldPath(storeDir, field), mmap_mode='r+')
+        else:
+            tmpPath = fieldPath(storeDir, field + '.tmp')
+            matrix = np.lib.format.open_memmap(tmpPath, mode='w+', dtype=np.float64, shape=(len(dates), len(tickers)))
+
+        try:
+            if not sameLayout:
+                matrix[:] = np.nan
+                if kept:
+                    #Old dates only the changed CSVs had are gone from dates
+                    present = np.isin(oldStore.dateKeys, dates)
+                    rows = np.searchsorted(dates, oldStore.dateKeys[present])
+                    oldMatrix = oldStore.matrix(field)
+                    for t in kept:
+                        matrix[rows, tickers.index(t)] = oldMatrix[present, oldColumn[t]]
+
+            for t, (tickerDates, values) in parsed.items():
+                column = tickers.index(t)
+                if sameLayout:
+                    matrix[:, column] = np.nan
+                matrix[np.searchsorted(dates, tickerDates), column] = values[:, k]
+
+            matrix.flush()
+        except Exception:
+            del matrix
+            if not sameLayout:
+                os.remove(tmpPath)
+            raise
+        del matrix
+        if not sameLayout:
+            os.replace(tmpPath, fieldPath(storeDir, field))
+
+    if not sameLayout:
+        np.save(os.path.join(storeDir, 'dates.npy'), dates)
+
+    with open(os.path.join(storeDir, 'manifest.json'), 'w') as f:
+        json.dump({'csvDir': os.path.abspath(csvDir), 'fields': fields, 'tickers': tickers, 'files': signatures}, f)
+
+    return changed
+
+class PriceStore(object):
+    '''
+    Memory-mapped view of a price store written by buildPriceStore
+
+    Date ranges are contiguous rows of every field matrix and are returned as
+    views of the mapped file. A subset of tickers copies only the requested
+    block.
+    '''
+    def __init__(self, storeDir=defaultStoreDir):
+        manifest = readManifest(storeDir)
+        if manifest is None:
+            raise IOError('No price store in %s, run buildPriceStore first' % storeDir)
+
+        self.storeDir = storeDir
+        self.tickers = manifest['tickers']
+        self.columns = dict((t, i) for i, t in enumerate(self.tickers))
+        self.dateKeys = np.load(os.path.join(storeDir, 'dates.npy'))
+        self.dates = pd.to_datetime(self.dateKeys.astype(str), format='%Y%m%d')
+        self.matrices = {}
+
+    def matrix(self, field='close'):
+        #Full date x ticker matrix of a field, mapped on first use
+        if field not in self.matrices:
+            self.matrices[field] = np.load(fieldPath(self.storeDir, field), mmap_mode='r')
+        return self.matrices[field]
+
+    def rows(self, startDate=None, endDate=None):
+        #Slice of the rows between startDate and endDate inclusive
+        start = 0 if startDate is None else self.dates.searchsorted(pd.Timestamp(startDate))
+        stop = len(self.dates) if endDate is None else self.dates.searchsorted(pd.Timestamp(endDate), side='right')
+        return slice(start, stop)
+
+    def values(self, symbols=None, startDate=None, endDate=None, field='close'):
+        '''
+        Returns the field for the symbols between startDate and endDate as a
+        date x symbol array, a view when all tickers are requested
+        '''
+        rows = self.rows(startDate, endDate)
+        if symbols is None:
+            return self.matrix(field)[rows]
+
+        columns = [self.columns[s.upper()] for s in symbols]
+        return self.matrix(field)[rows].take(columns, axis=1)
+
+    def getStockQuotes(self, symbols, startDate=None, endDate=None, field='close'):
+        '''
+        Returns a DataFrame of the field for each symbol, indexed by date
+        '''
+        rows = self.rows(startDate, endDate)
+        return pd.DataFrame(self.values(symbols, startDate, endDate, field), index=self.dates[rows], \
+                            columns=list(symbols), copy=False)
+
+if __name__ == '__main__':
+    changed = buildPriceStore()
+    print('Parsed %i CSVs into %s' % (len(changed), defaultStoreDir))
@@ -0,0 +1,140 @@
+################################################################################
+
+#Rolling window estimates of mean returns and covariance
+
+#The estimates match DataFrame.mean() and DataFrame.cov() over the window,
+#missing returns are skipped pairwise as pandas does. Instead of recomputing
+#the covariance at every date the window keeps running sums, for every pair
+#of assets, of the observation count, the returns and the return products
+#over the periods both assets traded. Periods entering and leaving the window
+#are added and subtracted as blocks, so each date costs O(N^2) per period
+#moved rather than O(W*N^2).
+
+################################################################################
+
+import collections
+import numpy as np
+import pandas as pd
+
+class RollingMoments(object):
+    '''
+    Running pairwise-complete mean and covariance over the last window
+    periods of returns
+
+    INPUT
+    numAssets: number of assets in each period
+    window: number of periods in the window
+    minPeriods: fewest common periods needed for an estimate, NaN otherwise
+    resync: the sums are recomputed from the window every resync periods to
+            stop rounding errors from building up, defaults to window
+    '''
+    def __init__(self, numAssets, window, minPeriods=2, resync=None):
+        self.numAssets = numAssets
+        self.window = window
+        self.minPeriods = max(minPeriods, 2)
+        self.resync = window if resync is None else resync
+        self.rows = collections.deque()
+        self.sinceResync = 0
+        self.reset()
+
+    def reset(self):
+        n = self.numAssets
+        self.count = np.zeros((n, n))
+        self.sums = np.zeros((n, n))
+        self.products = np.zeros((n, n))
+
+    def accumulate(self, returns, sign):
+        #Adds (sign=1) or removes (sign=-1) a block of periods from the sums
+        present = (~np.isnan(returns)).astype(float)
+        values = np.where(present > 0, returns, 0.0)
+        self.count += sign*np.dot(present.T, present)
+        self.sums += sign*np.dot(values.T, present)
+        self.products += sign*np.dot(values.T, values)
+
+    def push(self, returns):
+        '''
+        Adds one period (1-D) or a block of periods (2-D) of returns to the
+        window, dropping the oldest periods beyond the window length
+        '''
+        returns = np.atleast_2d(np.asarray(returns, dtype=float))[-self.window:]
+        numOut = max(0, len(self.rows) + len(returns) - self.window)
+        leaving = [self.rows.popleft() for i in range(numOut)]
+        self.rows.extend(returns)
+
+        self.sinceResync += len(returns)
+        if self.sinceResync >= self.resync:
+            self.reset()
+            self.accumulate(np.array(self.rows), 1)
+            self.sinceResync = 0
+        else:
+            if leaving:
+                self.accumulate(np.array(leaving), -1)
+            self.accumulate(returns, 1)
+
+    def counts(self):
+        #Number of observations of each asset in the window
+        return np.diag(self.count).copy()
+
+    def mean(self):
+        n = self.counts()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(n >= self.minPeriods, np.diag(self.sums)/n, np.nan)
+
+    def cov(self):
+        n = self.count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = (self.products - self.sums*self.sums.T/n)/(n - 1)
+        cov[n < self.minPeriods] = np.nan
+        return (cov + cov.T)/2
+
+def completeAssets(cov, counts, minPeriods):
+    '''
+    Returns a mask of the assets with enough observations whose covariances
+    with each other are all defined, dropping the asset missing the most
+    covariances first
+    '''
+    keep = counts >= minPeriods
+    missing = np.isnan(cov)
+    while True:
+        numMissing = (missing[:, keep][keep]).sum(axis=1)
+        if len(numMissing) == 0 or numMissing.max() == 0:
+            return keep
+        keep[np.flatnonzero(keep)[np.argmax(numMissing)]] = False
+
+def rollingEstimates(rets, window, minPeriods=None, step=1, resync=None, dropMissing=True):
+    '''
+    Streams the rolling mean returns and covariance of a DataFrame of returns
+
+    INPUT
+    rets: DataFrame of returns indexed by date, NaN where an asset did not trade
+    window: number of periods in each estimate
+    minPeriods: fewest common periods for an estimate, defaults to window/2
+    step: an estimate is produced every step periods, e.g. at rebalance dates
+    resync: see RollingMoments
+    dropMissing: leave out assets without complete estimates so the results
+                 can be passed straight to the optimizers
+
+    OUTPUT
+    generator of (date, meanReturns, covMatrix) as a Series and DataFrame
+    labelled by asset, starting once the first full window is in
+    '''
+    if minPeriods is None:
+        minPeriods = max(2, window//2)
+    values = rets.values.astype(float)
+    moments = RollingMoments(values.shape[1], window, minPeriods, resync)
+    assets = np.asarray(rets.columns)
+
+    last = 0
+    for end in range(window, len(values) + 1, step):
+        moments.push(values[max(last, end - window):end])
+        last = end
+
+        meanReturns = moments.mean()
+        covMatrix = moments.cov()
+        if dropMissing:
+            keep = completeAssets(covMatrix, moments.counts(), minPeriods)
+        else:
+            keep = np.ones(len(assets), dtype=bool)
+
+        yield rets.index[end - 1], pd.Series(meanReturns[keep], index=assets[keep]), \
+              pd.DataFrame(covMatrix[np.ix_(keep, keep)], index=assets[keep], columns=assets[keep])
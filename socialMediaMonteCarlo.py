@@ -1,4 +1,7 @@
+import math
 import random
+import numpy as np
+import scipy.stats as st
 
 def runTrial():
     numFB = 0
@@ -43,6 +46,61 @@ def runSimulation(numTrials, printProb=True, storeResults=True):
     
     return probFromSim, trialNum, probVsTrialNum
     
+def exactProbability(tweetProb=0.8, fbProb=0.6, numTweets=2, numFB=2, minTweets=1, minFB=1):
+    #Tweets and FB posts are independent binomials, success needs enough of both
+    def atLeast(k, n, p):
+        return sum(math.factorial(n)/(math.factorial(i)*math.factorial(n-i))*p**i*(1-p)**(n-i) for i in range(k, n+1))
+        
+    return atLeast(minTweets, numTweets, tweetProb)*atLeast(minFB, numFB, fbProb)
+    
+def runSimulationBatch(ciWidth=1E-4, tweetProb=0.8, fbProb=0.6, numTweets=2, numFB=2, minTweets=1, minFB=1, \
+                       confidence=0.95, blockSize=10**6, maxTrials=10**9, checkExact=False, printProb=True, \
+                       randomState=np.random):
+    '''
+    Runs trials a block at a time until the confidence interval of the
+    probability is narrower than ciWidth or maxTrials have been run.
+    runTrial is the default case: 2 chances each of a tweet (0.8) and a
+    FB post (0.6), success needs at least 1 of both.
+    
+    The number of tweets and FB posts in a trial are binomial, so each
+    block draws them directly. The history of the estimate is stored
+    after every block. The Wilson score interval used to stop is returned
+    as (low, high) after the history.
+    '''
+    z = st.norm.ppf(0.5 + confidence/2.0)
+    numSuccesses = 0
+    numRun = 0
+    trialNum = []
+    probVsTrialNum = []
+    
+    while numRun < maxTrials:
+        n = min(blockSize, maxTrials - numRun)
+        tweets = randomState.binomial(numTweets, tweetProb, n)
+        posts = randomState.binomial(numFB, fbProb, n)
+        numSuccesses += np.count_nonzero((tweets >= minTweets) & (posts >= minFB))
+        numRun += n
+        
+        probFromSim = float(numSuccesses)/numRun
+        trialNum.append(numRun)
+        probVsTrialNum.append(probFromSim)
+        
+        #Wilson score interval
+        center = (probFromSim + z**2/(2.0*numRun))/(1 + z**2/numRun)
+        halfWidth = z*math.sqrt(probFromSim*(1 - probFromSim)/numRun + z**2/(4.0*numRun**2))/(1 + z**2/numRun)
+        interval = (center - halfWidth, center + halfWidth)
+        if 2*halfWidth <= ciWidth:
+            break
+            
+    if printProb:
+        print "Probability is %f, interval (%f, %f) after %d trials" % (probFromSim, interval[0], interval[1], numRun)
+        
+    if checkExact:
+        exact = exactProbability(tweetProb, fbProb, numTweets, numFB, minTweets, minFB)
+        print "Exact probability is %f, %s the interval" % \
+              (exact, 'inside' if interval[0] <= exact <= interval[1] else 'outside')
+        
+    return probFromSim, trialNum, probVsTrialNum, interval
+    
 #Run some number of simulations and average the results
 #averageProb = 0
 #numSims = 10
@@ -54,3 +112,6 @@ def runSimulation(numTrials, printProb=True, storeResults=True):
 #    
 #averageProb /= numSims
 #print "Probability is %f" % averageProb
+#
+#Or run blocks of trials until the 95% interval is 1E-4 wide
+#pSim, tN, pVstN, interval = runSimulationBatch(1E-4, checkExact=True)